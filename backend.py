@@ -0,0 +1,59 @@
+import importlib
+import sys
+
+# Solver backend
+#
+# Loading z3 (its native library above all) is the largest part of starting up, and
+# parsing, validating and canonicalizing problems do not need it. The modules of the
+# solve pipeline reach z3 through the handle z3 below instead of importing it: the
+# module is imported the first time one of its attributes is used, i.e. when a
+# problem is actually lowered or solved. Attributes are then cached on the handle,
+# so later uses cost a plain attribute lookup. Another module with the same API can
+# be put behind the handle with use_backend before anything is lowered.
+
+BACKEND = "z3"
+
+class LazyModule:
+    """
+    Stands for the module of the given name, imported on first use of one of its attributes.
+
+    Example:
+    >>> math = LazyModule("math")
+    >>> math.loaded()
+    False
+    >>> math.sqrt(4)
+    2.0
+    >>> math.loaded()
+    True
+    """
+    def __init__(self, name):
+        self.__dict__["module_name"] = name
+        self.__dict__["module"] = None
+
+    def load(self):
+        if self.module is None:
+            self.__dict__["module"] = importlib.import_module(self.module_name)
+        return self.module
+
+    def loaded(self):
+        return self.module is not None
+
+    def __getattr__(self, attribute):
+        value = getattr(self.load(), attribute)
+        self.__dict__[attribute] = value
+        return value
+
+z3 = LazyModule(BACKEND)
+
+def use_backend(name):
+    '''
+    Puts the module of the given name behind the z3 handle, forgetting the attributes cached so far
+    '''
+    z3.__dict__.clear()
+    z3.__dict__.update(module_name=name, module=None)
+
+def z3_loaded():
+    '''
+    Whether the z3 library has been imported in this process, by the handle or otherwise
+    '''
+    return "z3" in sys.modules
@@ -0,0 +1,107 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from parsers import ParseDiophantine
+from solve import solve_problem, error_result
+from cache import ResultCache
+
+# Batch solving of many problem files
+#
+# Problems are fanned out over a process pool. Every worker builds its parser
+# and a z3 solver per logic once and reuses them for all the problems it receives,
+# and the results are yielded as soon as each problem finishes (not in input order).
+
+worker_parser = None
+worker_solvers = None
+worker_cache = None
+
+def problem_files(source, manifest=False):
+    '''
+    Returns the problem files given a directory (all its .txt files), a glob pattern,
+    a single file or, with manifest=True, a file listing one problem path per line
+    '''
+    if manifest:
+        base = os.path.dirname(source)
+        with open(source) as file:
+            lines = [line.strip() for line in file]
+        return [os.path.join(base, line) for line in lines if line != "" and not line.startswith("#")]
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(source, "*.txt")))
+    if glob.has_magic(source):
+        return sorted(glob.glob(source, recursive=True))
+    return [source]
+
+def init_worker(cache_path=None):
+    global worker_parser, worker_solvers, worker_cache
+    worker_parser = ParseDiophantine()
+    # one solver per logic, see classify.make_solver
+    worker_solvers = {}
+    worker_cache = ResultCache(path=cache_path) if cache_path else None
+
+def solve_file(path):
+    '''
+    Solves one problem file in a worker, errors are reported in the result instead of raised
+    '''
+    if worker_parser is None:
+        init_worker()
+
+    start = time.perf_counter()
+    try:
+        with open(path) as file:
+            description = file.read()
+        read_time = time.perf_counter() - start
+        result = solve_problem(description, worker_parser, cache=worker_cache, solvers=worker_solvers)
+        result["timings"] = {"read": read_time, **result["timings"]}
+    except Exception as error:
+        result = error_result(error, {"total": time.perf_counter() - start})
+    return {"file": path, **result}
+
+def solve_batch(paths, processes=None, chunksize=1, cache_path=None):
+    """
+    Solves every problem file in paths using a pool of processes (one per CPU by default)
+    and yields a result dictionary per file as soon as it is solved.
+    With processes=1 everything runs in the current process. With cache_path, the workers
+    share a SQLite result cache at that path.
+
+    Example:
+    >>> results = solve_batch(["examples/example4.txt", "missing.txt"], processes=1)
+    >>> [(result["file"], result["status"]) for result in results]
+    [('examples/example4.txt', 'unsat'), ('missing.txt', 'error')]
+    """
+    if processes == 1:
+        init_worker(cache_path)
+        for path in paths:
+            yield solve_file(path)
+        return
+
+    with multiprocessing.Pool(processes, initializer=init_worker, initargs=(cache_path,)) as pool:
+        for result in pool.imap_unordered(solve_file, paths, chunksize):
+            yield result
+
+def main(arguments=None):
+    argument_parser = argparse.ArgumentParser(description="Solve many problem files and write the results as JSON lines")
+    argument_parser.add_argument("source", help="directory, glob pattern or problem file")
+    argument_parser.add_argument("--manifest", action="store_true", help="source is a file listing one problem path per line")
+    argument_parser.add_argument("-j", "--processes", type=int, default=None, help="number of worker processes (default: one per CPU)")
+    argument_parser.add_argument("--chunksize", type=int, default=1, help="problems sent to a worker at a time")
+    argument_parser.add_argument("--cache", default=None, help="SQLite file to cache results in, shared by the workers")
+    argument_parser.add_argument("-o", "--output", default=None, help="output file (default: standard output)")
+    arguments = argument_parser.parse_args(arguments)
+
+    paths = problem_files(arguments.source, arguments.manifest)
+    output = open(arguments.output, "w") if arguments.output else sys.stdout
+    try:
+        for result in solve_batch(paths, arguments.processes, arguments.chunksize, arguments.cache):
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+if __name__ == "__main__":
+    main()
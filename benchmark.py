@@ -0,0 +1,300 @@
+import argparse
+import json
+import random
+import statistics
+import string
+import subprocess
+import sys
+import time
+
+from backend import z3
+from parsers import ParseDiophantine, tokenize
+from solve import lower_problem
+
+# Benchmark suite
+#
+# Problems in the language of grammar.md are generated from a seed, so the same
+# suite is produced on every run. A satisfiable problem is built around a hidden
+# assignment of the variables: the right side of every equation is the value of
+# its left side, and every constraint holds for the assignment. An unsatisfiable
+# problem is a satisfiable one plus an equation contradicting one of its equations
+# (same left side, another right side). Every phase of solving is timed on its own
+# and the totals can be compared with a baseline saved by an earlier run. Startup,
+# importing the modules a mode needs and handling one small problem in a fresh
+# interpreter, is timed for every mode as well.
+
+NAMES = string.ascii_lowercase
+SOLVER_TIMEOUT = 10000
+
+SUITE = [
+    ("small", {}),
+    ("many-variables", {"variables": 12, "equations": 3, "degree": 1}),
+    ("many-equations", {"variables": 6, "equations": 12}),
+    ("high-degree", {"degree": 4, "equations": 1, "variables": 2}),
+    ("deep-nesting", {"depth": 6}),
+    ("many-constraints", {"constraints": 8}),
+    ("or-heavy", {"constraints": 4, "or_ratio": 0.9}),
+    ("linear", {"degree": 1, "variables": 8, "equations": 6, "constraints": 0}),
+]
+
+STARTUP_PROBLEM = "Solve x*x + y = 7, x - y = 1 such that x > 0."
+STARTUP_MODES = [
+    ("interpreter", "pass"),
+    ("validate", "import validate; validate.validate_problem(PROBLEM)"),
+    ("solve", "import solve; solve.solve_problem(PROBLEM)"),
+    ("z3", "import z3"),
+]
+
+class Generator:
+    """
+    Seeded generator of random problems: variables is the number of variables, equations and
+    constraints the number of each, degree the largest degree of a monomial, depth how deep
+    parenthesized subexpressions are nested and or_ratio the share of 'or' among the boolean
+    operators of the constraints.
+
+    Example:
+    >>> problem = Generator(seed=1, variables=3, equations=2, constraints=1).problem()
+    >>> problem == Generator(seed=1, variables=3, equations=2, constraints=1).problem()
+    True
+    >>> parsed = ParseDiophantine().parse_problem(problem["text"])
+    >>> len(parsed["equations"]), len(parsed["constraints"]), problem["expected"]
+    (2, 1, 'sat')
+    >>> all(node.evaluate(problem["assignment"]) for node in parsed["equations"] + parsed["constraints"])
+    True
+    """
+    def __init__(self, seed=0, variables=3, equations=2, degree=2, depth=2, constraints=2, or_ratio=0.5,
+                 terms=4, value_range=5):
+        if not 1 <= variables <= len(NAMES):
+            raise ValueError(f"The number of variables must be between 1 and {len(NAMES)}")
+        self.random = random.Random(seed)
+        self.names = list(NAMES[:variables])
+        self.equations = equations
+        self.degree = degree
+        self.depth = depth
+        self.constraints = constraints
+        self.or_ratio = or_ratio
+        self.terms = terms
+        self.value_range = value_range
+
+    def monomial(self, assignment):
+        coefficient = self.random.randint(1, 9)
+        factors = [self.random.choice(self.names) for _ in range(self.random.randint(1, self.degree))]
+        value = coefficient
+        for name in factors:
+            value *= assignment[name]
+        return " * ".join([str(coefficient)] + factors), value
+
+    def expression(self, assignment, depth):
+        '''
+        Returns (text, value under the assignment) of a sum of monomials and nested groups
+        '''
+        text, value = self.monomial(assignment)
+        for _ in range(self.random.randint(0, self.terms - 1)):
+            if depth > 0 and self.random.random() < 0.5:
+                term, term_value = self.expression(assignment, depth - 1)
+                term = f"({term})"
+                if self.random.random() < 0.5:
+                    multiplier = self.random.randint(2, 5)
+                    term, term_value = f"{multiplier}{term}", multiplier * term_value
+            else:
+                term, term_value = self.monomial(assignment)
+            if self.random.random() < 0.5:
+                text, value = f"{text} - {term}", value - term_value
+            else:
+                text, value = f"{text} + {term}", value + term_value
+        return text, value
+
+    def comparison(self, assignment, holds):
+        text, value = self.expression(assignment, 0)
+        margin = self.random.randint(0, 3)
+        if self.random.random() < 0.5:
+            return f"{text} > {value - 1 - margin if holds else value + margin}"
+        return f"{text} < {value + 1 + margin if holds else value - margin}"
+
+    def boolean(self, assignment, depth, holds=True):
+        '''
+        Returns the text of a random combination of comparisons which is true under the assignment if holds
+        '''
+        if depth == 0 or self.random.random() < 0.3:
+            return self.comparison(assignment, holds)
+        if self.random.random() < self.or_ratio:
+            # a union holds if one of its branches holds
+            left_holds = self.random.random() < 0.5 if holds else False
+            right_holds = holds and not left_holds or holds and self.random.random() < 0.5
+            operator = "or"
+        else:
+            left_holds = right_holds = holds
+            if not holds:
+                left_holds = self.random.random() < 0.5
+            operator = "and"
+        left = self.boolean(assignment, depth - 1, left_holds)
+        right = self.boolean(assignment, depth - 1, right_holds)
+        return f"({left} {operator} {right})"
+
+    def problem(self, satisfiable=True):
+        '''
+        Returns {"text", "expected": "sat" | "unsat", "assignment"} of a new random problem
+        '''
+        assignment = {name: self.random.randint(-self.value_range, self.value_range) for name in self.names}
+        equations = []
+        for _ in range(self.equations):
+            text, value = self.expression(assignment, self.depth)
+            equations.append((text, value))
+        constraints = [self.boolean(assignment, min(self.depth, 3)) for _ in range(self.constraints)]
+        if not satisfiable:
+            text, value = self.random.choice(equations)
+            equations.append((text, value + self.random.randint(1, 9)))
+
+        description = "Solve " + ",\n".join(f"{text} = {value}" for text, value in equations)
+        if constraints:
+            description += "\nsuch that\n" + ",\n".join(constraints)
+        return {"text": description + ".", "expected": "sat" if satisfiable else "unsat", "assignment": assignment}
+
+def generate_suite(seed=0, instances=2, suite=SUITE):
+    '''
+    Returns the list of (name, problem) of the benchmark: for every configuration of the suite,
+    instances satisfiable and instances unsatisfiable problems
+    '''
+    problems = []
+    for configuration, parameters in suite:
+        generator = Generator(seed=f"{seed}-{configuration}", **parameters)
+        for index in range(instances):
+            for satisfiable in (True, False):
+                problem = generator.problem(satisfiable)
+                problems.append((f"{configuration}/{problem['expected']}-{index}", problem))
+    return problems
+
+def time_phases(text, timeout=SOLVER_TIMEOUT):
+    '''
+    Times tokenizing, parsing (which includes tokenizing), lowering to z3 and solving a problem,
+    returns the dictionary of timings in seconds and the status found by z3
+    '''
+    timings = {}
+    start = time.perf_counter()
+    tokenize(text)
+    timings["tokenize"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parsed = ParseDiophantine().parse_problem(text)
+    timings["parse"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    assertions = lower_problem(parsed)
+    timings["toz3"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    solver = z3.Solver()
+    solver.set("timeout", timeout)
+    solver.add(assertions)
+    status = str(solver.check())
+    timings["solve"] = time.perf_counter() - start
+    return timings, status
+
+def run_benchmark(problems, repeat=3, timeout=SOLVER_TIMEOUT):
+    """
+    Runs every problem repeat times and returns the report: the median time of every phase
+    for every problem, the status found and the totals of every phase over the suite.
+
+    Example:
+    >>> report = run_benchmark(generate_suite(instances=1, suite=[("small", {})]), repeat=1)
+    >>> sorted(report["totals"]), [problem["status"] for problem in report["problems"].values()]
+    (['parse', 'solve', 'tokenize', 'toz3'], ['sat', 'unsat'])
+    """
+    results = {}
+    for name, problem in problems:
+        runs = [time_phases(problem["text"], timeout) for _ in range(repeat)]
+        phases = runs[0][0]
+        results[name] = {
+            "expected": problem["expected"],
+            "status": runs[-1][1],
+            "timings": {phase: statistics.median(timings[phase] for timings, status in runs) for phase in phases}
+        }
+
+    totals = {}
+    for result in results.values():
+        for phase, seconds in result["timings"].items():
+            totals[phase] = totals.get(phase, 0.0) + seconds
+    return {"problems": results, "totals": totals}
+
+def time_startup(repeat=5, modes=STARTUP_MODES, problem=STARTUP_PROBLEM):
+    """
+    Runs the code of every mode repeat times in a fresh interpreter, with PROBLEM set to the text
+    of problem, and returns the median wall time of every mode in seconds, interpreter startup
+    included ("interpreter" alone is the time of an interpreter doing nothing).
+
+    Example:
+    >>> sorted(time_startup(repeat=1))
+    ['interpreter', 'solve', 'validate', 'z3']
+    """
+    startup = {}
+    for mode, code in modes:
+        runs = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", f"PROBLEM = {problem!r}\n{code}"], check=True)
+            runs.append(time.perf_counter() - start)
+        startup[mode] = statistics.median(runs)
+    return startup
+
+def compare(report, baseline, tolerance=0.25, minimum=0.005, section="totals"):
+    """
+    Returns the phases whose total time grew by more than tolerance (a fraction) compared with
+    the baseline report, as {phase: (baseline seconds, current seconds)}. Differences smaller
+    than minimum seconds are ignored as noise. section is the part of the reports compared,
+    "totals" or "startup".
+
+    Example:
+    >>> compare({"totals": {"parse": 0.5, "solve": 2.0}}, {"totals": {"parse": 0.3, "solve": 2.1}})
+    {'parse': (0.3, 0.5)}
+    """
+    regressions = {}
+    for phase, seconds in report.get(section, {}).items():
+        before = baseline.get(section, {}).get(phase)
+        if before is None:
+            continue
+        if seconds > before * (1 + tolerance) and seconds - before > minimum:
+            regressions[phase] = (before, seconds)
+    return regressions
+
+def main(arguments=None):
+    argument_parser = argparse.ArgumentParser(description="Time the phases of solving a generated suite of problems")
+    argument_parser.add_argument("--seed", type=int, default=0, help="seed of the generator")
+    argument_parser.add_argument("--instances", type=int, default=2, help="sat and unsat problems per configuration")
+    argument_parser.add_argument("--repeat", type=int, default=3, help="runs per problem, the median is kept")
+    argument_parser.add_argument("--timeout", type=int, default=SOLVER_TIMEOUT, help="z3 timeout per problem in milliseconds")
+    argument_parser.add_argument("-o", "--output", default=None, help="JSON file to write the report to")
+    argument_parser.add_argument("--baseline", default=None, help="JSON report of an earlier run to compare with")
+    argument_parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown of a phase, as a fraction")
+    argument_parser.add_argument("--startup", action="store_true", help="also time the startup of every mode in a fresh interpreter")
+    arguments = argument_parser.parse_args(arguments)
+
+    report = run_benchmark(generate_suite(arguments.seed, arguments.instances), arguments.repeat, arguments.timeout)
+    report["settings"] = {"seed": arguments.seed, "instances": arguments.instances, "repeat": arguments.repeat}
+    if arguments.startup:
+        report["startup"] = time_startup(arguments.repeat)
+    if arguments.output:
+        with open(arguments.output, "w") as file:
+            json.dump(report, file, indent=2, sort_keys=True)
+
+    for phase, seconds in sorted(report["totals"].items()):
+        print(f"{phase:10} {seconds * 1000:10.2f} ms")
+    for mode, seconds in report.get("startup", {}).items():
+        print(f"startup {mode:12} {seconds * 1000:10.2f} ms")
+    wrong = [name for name, result in report["problems"].items() if result["status"] not in (result["expected"], "unknown")]
+    if wrong:
+        print("Wrong status: " + ", ".join(wrong))
+        return 1
+
+    if arguments.baseline:
+        with open(arguments.baseline) as file:
+            baseline = json.load(file)
+        regressions = compare(report, baseline, arguments.tolerance)
+        regressions.update({f"startup {mode}": times for mode, times in compare(report, baseline, arguments.tolerance, section="startup").items()})
+        for phase, (before, after) in sorted(regressions.items()):
+            print(f"Regression in {phase}: {before * 1000:.2f} ms -> {after * 1000:.2f} ms")
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
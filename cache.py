@@ -0,0 +1,218 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from symbolic_classes import postorder, Equation, Conjunction, OrUnion, GreaterThan, LessThan
+from polynomial import Polynomial, boolean_operands
+
+# Cache of solved problems
+#
+# Problems are keyed by a canonical hash of the parsed problem which does not depend
+# on whitespace, on the order of the equations and constraints, on the order of the
+# operands of commutative operations or on the names of the variables: variables are
+# renamed to v0, v1, ... in an order given by how they occur in the problem (refined a
+# few rounds, like colour refinement of a graph). Models are stored with the canonical
+# names and mapped back to the names of whoever asks.
+
+REFINEMENT_ROUNDS = 3
+
+def relation_shape(node):
+    '''
+    Precomputes the polynomial form of a node: ("=" | ">", Polynomial) or ("and" | "or", [shapes])
+    '''
+    shapes = {}
+    for current in postorder(node, boolean_operands):
+        if isinstance(current, (Conjunction, OrUnion)):
+            kind = "and" if isinstance(current, Conjunction) else "or"
+            shapes[id(current)] = (kind, [shapes[id(operand)] for operand in current.operands()])
+            continue
+        polynomial = Polynomial.from_relation(current)
+        if isinstance(current, Equation):
+            shapes[id(current)] = ("=", polynomial)
+        elif isinstance(current, GreaterThan):
+            shapes[id(current)] = (">", polynomial)
+        elif isinstance(current, LessThan):
+            shapes[id(current)] = (">", -polynomial)
+        else:
+            raise TypeError(f"Cannot build the shape of {type(current).__name__}")
+    return shapes[id(node)]
+
+def shape_operands(shape):
+    kind, content = shape
+    return content if kind in ("and", "or") else ()
+
+def render(shape, names):
+    '''
+    Canonical text of a shape with the variables renamed by the dictionary names
+    '''
+    texts = {}
+    for current in postorder([shape], shape_operands):
+        kind, content = current
+        if kind in ("and", "or"):
+            texts[id(current)] = f"{kind}(" + ",".join(sorted(texts[id(child)] for child in content)) + ")"
+        else:
+            texts[id(current)] = render_relation(kind, content, names)
+    return texts[id(shape)]
+
+def render_relation(kind, polynomial, names):
+    terms = {}
+    for monomial, coefficient in polynomial.terms.items():
+        renamed = {}
+        for name, exponent in monomial:
+            renamed[names[name]] = renamed.get(names[name], 0) + exponent
+        monomial = tuple(sorted(renamed.items()))
+        terms[monomial] = terms.get(monomial, 0) + coefficient
+    polynomial = Polynomial(terms)
+    if kind == "=" and polynomial.leading_coefficient() < 0:
+        polynomial = -polynomial
+    return f"{kind}{polynomial.key()}"
+
+def canonical_problem(parsed):
+    """
+    Returns (hash, renaming) of a parsed problem, where renaming maps the variable names of the
+    problem to the canonical names used in the hash.
+
+    Example:
+    >>> from parsers import ParseDiophantine
+    >>> parser = ParseDiophantine()
+    >>> key1, renaming1 = canonical_problem(parser.parse_problem("Solve x + 2y = 3, x*x = y such that x > 0."))
+    >>> key2, renaming2 = canonical_problem(parser.parse_problem("Solve b = a*a,\\n 3 = 2*b + a  such that 0 < a."))
+    >>> key1 == key2, renaming1, renaming2
+    (True, {'y': 'v0', 'x': 'v1'}, {'b': 'v0', 'a': 'v1'})
+    """
+    shapes = [relation_shape(node) for node in list(parsed["equations"]) + list(parsed["constraints"])]
+    occurrences = {}
+    for shape, node in zip(shapes, list(parsed["equations"]) + list(parsed["constraints"])):
+        for name in node.variables():
+            occurrences.setdefault(name, []).append(shape)
+
+    # colour refinement: a variable is described by the nodes it occurs in, seen from it
+    colours = {name: "" for name in occurrences}
+    for _ in range(REFINEMENT_ROUNDS):
+        signatures = {}
+        for name, shapes_of_name in occurrences.items():
+            view = {other: f"c{colours[other]}" for other in colours}
+            view[name] = "#"
+            signatures[name] = "|".join(sorted(render(shape, view) for shape in shapes_of_name))
+        ranking = {signature: str(rank) for rank, signature in enumerate(sorted(set(signatures.values())))}
+        colours = {name: ranking[signature] for name, signature in signatures.items()}
+
+    # ties between variables with the same colour are broken by name
+    order = sorted(occurrences, key=lambda name: (int(colours[name]) if colours[name] else 0, name))
+    renaming = {name: f"v{index}" for index, name in enumerate(order)}
+    text = ";".join(sorted(render(shape, renaming) for shape in shapes))
+    return hashlib.sha256(text.encode()).hexdigest(), renaming
+
+class ResultCache:
+    """
+    Two-tier cache of definitive results ("sat"/"unsat"): an in-memory LRU holding at most
+    max_entries entries and max_bytes bytes of serialized results, and optionally a SQLite
+    database at path which can be shared by concurrent processes.
+
+    Example:
+    >>> from parsers import ParseDiophantine
+    >>> parser = ParseDiophantine()
+    >>> cache = ResultCache()
+    >>> cache.store(parser.parse_problem("Solve x + y = 3, x = 1."), {"status": "sat", "model": {"x": 1, "y": 2}, "engine": "linear"})
+    >>> cache.lookup(parser.parse_problem("Solve  b = 1, a + b = 3."))
+    {'status': 'sat', 'model': {'a': 2, 'b': 1}, 'engine': 'linear'}
+    """
+    def __init__(self, max_entries=10000, max_bytes=64 * 2 ** 20, path=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.path = path
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.connection = None
+        self.connection_pid = None
+        self.hits = 0
+        self.misses = 0
+
+    # SQLite tier
+
+    def database(self):
+        # connections cannot be shared with forked processes, every process opens its own
+        if self.path is None:
+            return None
+        if self.connection is None or self.connection_pid != os.getpid():
+            self.connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self.connection_pid = os.getpid()
+        return self.connection
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.update(connection=None, connection_pid=None, lock=None, entries=OrderedDict(), size=0)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    # in-memory tier
+
+    def remember(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = value
+            self.size += len(value)
+            while self.entries and (len(self.entries) > self.max_entries or self.size > self.max_bytes):
+                evicted_key, evicted_value = self.entries.popitem(last=False)
+                self.size -= len(evicted_value)
+
+    def recall(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def get(self, key):
+        value = self.recall(key)
+        if value is None and self.database() is not None:
+            row = self.database().execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                value = row[0]
+                self.remember(key, value)
+        return None if value is None else json.loads(value)
+
+    def put(self, key, entry):
+        value = json.dumps(entry, sort_keys=True)
+        self.remember(key, value)
+        if self.database() is not None:
+            self.database().execute("INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)", (key, value))
+
+    # problems
+
+    def lookup(self, parsed):
+        '''
+        Returns the cached result of a parsed problem with the model in its variable names, or None
+        '''
+        key, renaming = canonical_problem(parsed)
+        entry = self.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        model = entry["model"]
+        if model is not None:
+            model = {name: model[renaming[name]] for name in sorted(renaming) if renaming[name] in model}
+        return {"status": entry["status"], "model": model, "engine": entry["engine"]}
+
+    def store(self, parsed, result):
+        '''
+        Stores a definitive result of a parsed problem, other results are ignored
+        '''
+        if result["status"] not in ("sat", "unsat"):
+            return
+        key, renaming = canonical_problem(parsed)
+        model = result["model"]
+        if model is not None:
+            model = {renaming[name]: value for name, value in model.items() if name in renaming}
+        self.put(key, {"status": result["status"], "model": model, "engine": result["engine"]})
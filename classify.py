@@ -0,0 +1,57 @@
+from backend import z3
+from symbolic_classes import postorder, OrUnion
+from polynomial import relation_polynomials, boolean_operands
+
+# Classification of problems
+#
+# A problem is described by the largest degree of its relations once expanded to
+# polynomials (so x*x - (x + 1)*(x - 1) = y is linear), its number of variables,
+# equations and constraints and whether it has unions ('or'). The z3 logic is
+# chosen from it: QF_LIA for linear problems, QF_NIA otherwise.
+
+def classify_problem(parsed):
+    """
+    Returns the classification of a parsed problem as a dictionary with "linear", "degree",
+    "variables", "equations", "constraints", "disjunctions" and the z3 "logic" to solve it with.
+
+    Examples:
+    >>> from parsers import ParseDiophantine
+    >>> parser = ParseDiophantine()
+    >>> classify_problem(parser.parse_problem("Solve 2*x*x = -y such that x > 0 or y > 0."))
+    {'linear': False, 'degree': 2, 'variables': 2, 'equations': 1, 'constraints': 1, 'disjunctions': True, 'logic': 'QF_NIA'}
+    >>> classify_problem(parser.parse_problem("Solve x*x - (x + 1)*(x - 1) = y."))["logic"]
+    'QF_LIA'
+    """
+    nodes = list(parsed["equations"]) + list(parsed["constraints"])
+    degree = 0
+    names = set()
+    disjunctions = False
+    for node in nodes:
+        for polynomial in relation_polynomials(node):
+            degree = max(degree, polynomial.degree())
+        names |= node.variables()
+        disjunctions = disjunctions or any(isinstance(current, OrUnion) for current in postorder(node, boolean_operands))
+
+    return {
+        "linear": degree <= 1,
+        "degree": degree,
+        "variables": len(names),
+        "equations": len(parsed["equations"]),
+        "constraints": len(parsed["constraints"]),
+        "disjunctions": disjunctions,
+        "logic": "QF_LIA" if degree <= 1 else "QF_NIA"
+    }
+
+def make_solver(classification, solvers=None):
+    '''
+    Returns a z3 solver for the logic of a classification. If a dictionary solvers is given,
+    the solver of every logic is kept in it and reset to be reused for the next problems
+    '''
+    if solvers is None:
+        return z3.SolverFor(classification["logic"])
+    solver = solvers.get(classification["logic"])
+    if solver is None:
+        solver = solvers[classification["logic"]] = z3.SolverFor(classification["logic"])
+    else:
+        solver.reset()
+    return solver
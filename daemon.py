@@ -0,0 +1,210 @@
+import argparse
+import json
+import multiprocessing
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from backend import z3
+from parsers import ParseDiophantine
+from solve import solve_problem, error_result
+
+# Solver daemon
+#
+# A long running local HTTP service, so that solving a small problem does not pay
+# for starting an interpreter and importing z3 every time. Problems are solved in a
+# pool of worker processes started once, each with z3 imported and its parser built.
+# POST /solve takes the text of a problem in the format of grammar.md (a "timeout"
+# in seconds can be given in the query string) and answers with the result of
+# solve_problem as JSON; GET /status tells how many workers there are and how many
+# requests are being solved. At most queue_size requests are accepted at a time,
+# the others are turned away with 503 right away instead of waiting.
+
+HOST = "127.0.0.1"
+PORT = 8765
+QUEUE_SIZE = 64
+TIMEOUT = 30.0
+# time given to a worker on top of the z3 timeout to parse, lower and answer
+GRACE = 5.0
+
+worker_parser = None
+
+def init_worker():
+    global worker_parser
+    # z3 is loaded when the worker starts, so that the first request does not pay for it
+    z3.load()
+    worker_parser = ParseDiophantine()
+
+def solve_text(description, timeout):
+    '''
+    Solves one problem in a worker, errors are reported in the result instead of raised
+    '''
+    if worker_parser is None:
+        init_worker()
+    start = time.perf_counter()
+    try:
+        return solve_problem(description, worker_parser, timeout=timeout)
+    except Exception as error:
+        return error_result(error, {"total": time.perf_counter() - start})
+
+class SolverService:
+    """
+    The pool of warm workers behind the daemon, with the bound on the requests in progress.
+    solve() returns the result of a problem, "unknown" if the worker has not answered
+    timeout + GRACE seconds after it was accepted, or None if queue_size requests are
+    already in progress.
+    """
+    def __init__(self, processes=None, queue_size=QUEUE_SIZE, timeout=TIMEOUT):
+        self.pool = multiprocessing.Pool(processes, initializer=init_worker)
+        self.processes = processes or multiprocessing.cpu_count()
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(queue_size)
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.served = 0
+
+    def solve(self, description, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        if not self.slots.acquire(blocking=False):
+            return None
+        with self.lock:
+            self.pending += 1
+        start = time.perf_counter()
+        try:
+            answer = self.pool.apply_async(solve_text, (description, timeout))
+            try:
+                return answer.get(timeout + GRACE)
+            except multiprocessing.TimeoutError:
+                return {"status": "unknown", "model": None, "engine": None, "timings": {"total": time.perf_counter() - start}}
+        finally:
+            with self.lock:
+                self.pending -= 1
+                self.served += 1
+            self.slots.release()
+
+    def status(self):
+        with self.lock:
+            return {"workers": self.processes, "pending": self.pending, "served": self.served, "queue_size": self.queue_size}
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+class RequestHandler(BaseHTTPRequestHandler):
+    def send_json(self, code, content):
+        body = json.dumps(content).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/status":
+            self.send_json(404, {"status": "error", "error": f"No such path {self.path}"})
+            return
+        self.send_json(200, self.server.service.status())
+
+    def do_POST(self):
+        path, _, query = self.path.partition("?")
+        if path != "/solve":
+            self.send_json(404, {"status": "error", "error": f"No such path {path}"})
+            return
+        try:
+            parameters = dict(item.split("=", 1) for item in query.split("&") if item)
+            timeout = float(parameters["timeout"]) if "timeout" in parameters else None
+        except ValueError:
+            self.send_json(400, {"status": "error", "error": f"Bad query {query}"})
+            return
+        description = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+
+        result = self.server.service.solve(description, timeout)
+        if result is None:
+            self.send_json(503, {"status": "error", "error": "Too many requests in progress"})
+        else:
+            self.send_json(400 if result["status"] == "error" else 200, result)
+
+    def log_message(self, format, *arguments):
+        if self.server.verbose:
+            super().log_message(format, *arguments)
+
+class SolverServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service, verbose=False):
+        super().__init__(address, RequestHandler)
+        self.service = service
+        self.verbose = verbose
+
+    def server_close(self):
+        super().server_close()
+        self.service.close()
+
+def make_server(host=HOST, port=PORT, processes=None, queue_size=QUEUE_SIZE, timeout=TIMEOUT, verbose=False):
+    """
+    Starts the workers and returns the server listening on host:port (port 0 picks a free
+    one, see server_address), ready for serve_forever(). server_close() stops the workers.
+
+    Example:
+    >>> server = make_server(port=0, processes=1)
+    >>> threading.Thread(target=server.serve_forever, daemon=True).start()
+    >>> url = "http://%s:%d" % server.server_address
+    >>> request_solve(open("examples/example4.txt").read(), url)["status"]
+    'unsat'
+    >>> request_solve("Solve x*y = 6 such that x > 2, x < 5, y > 0, y < 4.", url, timeout=5)["model"]
+    {'x': 3, 'y': 2}
+    >>> request_solve("Solve x + = 1.", url)["status"]
+    'error'
+    >>> request_status(url)["served"]
+    3
+    >>> server.shutdown(); server.server_close()
+    """
+    service = SolverService(processes, queue_size, timeout)
+    try:
+        return SolverServer((host, port), service, verbose)
+    except OSError:
+        service.close()
+        raise
+
+def request_solve(description, url=f"http://{HOST}:{PORT}", timeout=None):
+    '''
+    Sends a problem to a running daemon and returns its JSON answer as a dictionary
+    '''
+    query = "" if timeout is None else f"?timeout={timeout}"
+    request = urllib.request.Request(f"{url}/solve{query}", data=description.encode(), method="POST")
+    try:
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as error:
+        # errors are answered in JSON as well
+        return json.load(error)
+
+def request_status(url=f"http://{HOST}:{PORT}"):
+    with urllib.request.urlopen(f"{url}/status") as response:
+        return json.load(response)
+
+def main(arguments=None):
+    argument_parser = argparse.ArgumentParser(description="Serve solving over HTTP on localhost with warm worker processes")
+    argument_parser.add_argument("--host", default=HOST, help="address to listen on")
+    argument_parser.add_argument("--port", type=int, default=PORT, help="port to listen on")
+    argument_parser.add_argument("-j", "--processes", type=int, default=None, help="number of worker processes (default: one per CPU)")
+    argument_parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help="requests accepted at a time, the others get 503")
+    argument_parser.add_argument("--timeout", type=float, default=TIMEOUT, help="default seconds after which a problem is answered as unknown")
+    argument_parser.add_argument("-v", "--verbose", action="store_true", help="log every request")
+    arguments = argument_parser.parse_args(arguments)
+
+    server = make_server(arguments.host, arguments.port, arguments.processes, arguments.queue_size, arguments.timeout, arguments.verbose)
+    print("Listening on http://%s:%d" % server.server_address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import multiprocessing
+import time
+
+from backend import z3
+from bounded_search import infer_bounds, box_size, search_box, MAX_BOX_SIZE
+from vectorized import Kernel, np
+from solve import lower_problem, problem_variables
+
+# Parallel enumeration of all the solutions
+#
+# Enumerating with one solver and a blocking clause per solution gets slower as the
+# clauses pile up. Here the domain of one or more bounded variables is cut into
+# disjoint ranges and every range is enumerated by its own solver, in a pool of
+# worker processes, so every solver only ever holds the blocking clauses of the
+# solutions in its range. The ranges are several times as many as the workers, so
+# that workers finishing early pick up more. Ranges whose box is small enough are
+# enumerated by the vectorized kernel instead of z3, as in bounded_search. Solutions
+# are yielded as the ranges finish, once each.
+
+RANGES_PER_PROCESS = 8
+
+worker_parsed = None
+worker_terms = None
+worker_names = None
+
+def split_domain(bounds, split, parts):
+    """
+    Cuts the box of the variables of split into about parts boxes, returned as a list of
+    {variable name: (low, high)}. The first variables are cut as finely as their domain allows
+    before the next ones are cut.
+
+    Example:
+    >>> split_domain({"x": (0, 9), "y": (0, 1)}, ["y", "x"], 6)
+    [{'y': (0, 0), 'x': (0, 2)}, {'y': (0, 0), 'x': (3, 6)}, {'y': (0, 0), 'x': (7, 9)}, {'y': (1, 1), 'x': (0, 2)}, {'y': (1, 1), 'x': (3, 6)}, {'y': (1, 1), 'x': (7, 9)}]
+    """
+    boxes = [{}]
+    for name in split:
+        low, high = bounds[name]
+        pieces = min(high - low + 1, -(-parts // len(boxes)))
+        if pieces <= 1:
+            ranges = [(low, high)]
+        else:
+            size = (high - low + 1) / pieces
+            edges = [low + round(size * index) for index in range(pieces + 1)]
+            ranges = [(edges[index], edges[index + 1] - 1) for index in range(pieces)]
+        boxes = [{**box, name: interval} for box in boxes for interval in ranges]
+    return boxes
+
+def init_worker(parsed, names):
+    global worker_parsed, worker_terms, worker_names
+    worker_parsed = parsed
+    worker_terms = lower_problem(parsed)
+    worker_names = names
+
+def enumerate_kernel(box, limit):
+    kernel = Kernel(list(worker_parsed["equations"]) + list(worker_parsed["constraints"]))
+    solutions = []
+    seen = set()
+    for point in search_box(kernel, box, limit=None if worker_names != list(box) else limit):
+        solution = tuple(point[name] for name in worker_names)
+        if solution not in seen:
+            seen.add(solution)
+            solutions.append(solution)
+    return solutions if limit is None else solutions[:limit]
+
+def enumerate_box(task):
+    '''
+    Enumerates all the solutions inside a box in a worker, at most limit of them,
+    returns (index of the box, solutions, seconds)
+    '''
+    index, box, limit = task
+    start = time.perf_counter()
+    size = box_size(box)
+    if np is not None and size is not None and size <= MAX_BOX_SIZE and set(box) == set(problem_variables(worker_parsed)):
+        return index, enumerate_kernel(box, limit), time.perf_counter() - start
+
+    solver = z3.Solver()
+    solver.add(worker_terms)
+    for name, (low, high) in box.items():
+        variable = z3.Int(name)
+        if low is not None:
+            solver.add(variable >= low)
+        if high is not None:
+            solver.add(variable <= high)
+
+    variables = [z3.Int(name) for name in worker_names]
+    solutions = []
+    while (limit is None or len(solutions) < limit) and solver.check() == z3.sat:
+        model = solver.model()
+        values = [model.eval(variable, model_completion=True) for variable in variables]
+        solutions.append(tuple(value.as_long() for value in values))
+        solver.add(z3.Or([variable != value for variable, value in zip(variables, values)]))
+    return index, solutions, time.perf_counter() - start
+
+def enumerate_partitioned(parsed, split=None, variables=None, bounds=None, processes=None, parts=None, limit=None, counts=None):
+    """
+    Lazily yields every solution of a parsed problem as a dictionary {variable name: value},
+    at most limit of them, enumerating the ranges of the split variables (by default the
+    bounded variables with the widest domains) in parallel, processes worker processes (one
+    per CPU by default) and parts ranges (RANGES_PER_PROCESS per process by default). bounds
+    {variable name: (low, high)} narrows the bounds inferred from the problem (see
+    bounded_search.infer_bounds) and is also imposed on the solutions; split variables must be
+    bounded, and so must every variable unless a limit is given, since the enumeration of an
+    unbounded range may never end: a ValueError is raised otherwise. If variables is given solutions are projected onto them, as in
+    solve.enumerate_solutions. If counts is given, it is filled with the number of "solutions"
+    yielded, of "duplicates" left out and, for every range enumerated, its bounds, number of
+    solutions and time in "ranges".
+
+    Examples:
+    >>> from parsers import ParseDiophantine
+    >>> parsed = ParseDiophantine().parse_problem("Solve x*x + y*y = 25.")
+    >>> counts = {}
+    >>> solutions = sorted((solution["x"], solution["y"]) for solution in enumerate_partitioned(parsed, bounds={"x": (-5, 5), "y": (-5, 5)}, processes=2, counts=counts))
+    >>> solutions
+    [(-5, 0), (-4, -3), (-4, 3), (-3, -4), (-3, 4), (0, -5), (0, 5), (3, -4), (3, 4), (4, -3), (4, 3), (5, 0)]
+    >>> counts["solutions"], counts["duplicates"], len(counts["ranges"])
+    (12, 0, 22)
+    >>> parsed = ParseDiophantine().parse_problem("Solve x + y = 4 such that x > 0, x < 4, y > -10, y < 10.")
+    >>> sorted(solution["x"] for solution in enumerate_partitioned(parsed, variables=["x"], processes=1))
+    [1, 2, 3]
+    >>> list(enumerate_partitioned(ParseDiophantine().parse_problem("Solve x + y = 4 such that x > 0.")))
+    Traceback (most recent call last):
+    ...
+    ValueError: Cannot enumerate all the solutions, x, y are not bounded (bound them with constraints or give a limit)
+    """
+    if counts is None:
+        counts = {}
+    names = problem_variables(parsed) if variables is None else list(variables)
+    inferred = infer_bounds(parsed)
+    counts.update({"solutions": 0, "duplicates": 0, "ranges": []})
+    if inferred is None:
+        return
+    for name, (low, high) in (bounds or {}).items():
+        inferred_low, inferred_high = inferred.get(name, (None, None))
+        inferred[name] = (max(low, inferred_low) if inferred_low is not None else low,
+                          min(high, inferred_high) if inferred_high is not None else high)
+        if inferred[name][0] > inferred[name][1]:
+            return
+
+    bounded = [name for name, (low, high) in inferred.items() if low is not None and high is not None]
+    if limit is None and box_size(inferred) is None:
+        unbounded = [name for name in inferred if name not in bounded]
+        raise ValueError(f"Cannot enumerate all the solutions, {', '.join(unbounded)} {'is' if len(unbounded) == 1 else 'are'} not bounded (bound them with constraints or give a limit)")
+    if split is None:
+        split = sorted(bounded, key=lambda name: inferred[name][0] - inferred[name][1])
+    for name in split:
+        if name not in bounded:
+            raise ValueError(f"Cannot split the domain of {name}, it has no bounds")
+
+    processes = processes or multiprocessing.cpu_count()
+    # every range is the box of the bounds with the domains of the split variables cut
+    boxes = [{**inferred, **box} for box in split_domain(inferred, split, parts or processes * RANGES_PER_PROCESS)]
+    tasks = [(index, box, limit) for index, box in enumerate(boxes)]
+
+    seen = set()
+    with multiprocessing.Pool(min(processes, len(tasks)), initializer=init_worker, initargs=(parsed, names)) as pool:
+        # leaving the with block terminates the workers still enumerating
+        for index, solutions, seconds in pool.imap_unordered(enumerate_box, tasks):
+            counts["ranges"].append({"bounds": boxes[index], "solutions": len(solutions), "time": seconds})
+            for solution in solutions:
+                if solution in seen:
+                    counts["duplicates"] += 1
+                    continue
+                seen.add(solution)
+                counts["solutions"] += 1
+                yield dict(zip(names, solution))
+                if limit is not None and counts["solutions"] == limit:
+                    return
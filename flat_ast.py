@@ -0,0 +1,211 @@
+from array import array
+
+from backend import z3
+from symbolic_classes import power_term, Equation, Variable, Constant, Addition, Multiplication, Power, Conjunction, OrUnion, GreaterThan, LessThan
+
+# Flat, array-backed representation of parsed problems
+#
+# Every node is a row of four typed arrays: its opcode, the indices of its left and
+# right children and a payload (the value of a constant or the index of a variable
+# name). Children always come before their parents, so all the passes are single
+# loops over the rows without recursion. Constants that do not fit in 64 bits are
+# kept in a side list. Shared nodes (see NodeFactory) are stored once.
+
+VARIABLE, CONSTANT, BIG_CONSTANT, ADDITION, MULTIPLICATION, EQUATION, GREATER_THAN, LESS_THAN, CONJUNCTION, OR_UNION, POWER = range(11)
+
+CLASSES = {
+    Addition: ADDITION, Multiplication: MULTIPLICATION, Equation: EQUATION,
+    GreaterThan: GREATER_THAN, LessThan: LESS_THAN, Conjunction: CONJUNCTION, OrUnion: OR_UNION,
+    Power: POWER,
+}
+OPCODE_CLASSES = {opcode: cls for cls, opcode in CLASSES.items()}
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+class FlatProblem:
+    """
+    Parsed problem stored in typed arrays. Converts from and to the {"equations", "constraints"}
+    dictionaries of ParseDiophantine.parse_problem, lowers to z3 and evaluates without recursion.
+
+    Example:
+    >>> from parsers import ParseDiophantine
+    >>> flat = FlatProblem.from_parsed(ParseDiophantine().parse_problem("Solve x*x + y = 3 such that x > 0 or y > x*x."))
+    >>> len(flat), flat.evaluate({"x": 1, "y": 2}), flat.evaluate({"x": 0, "y": 3})
+    (11, True, True)
+    >>> [str(equation) for equation in flat.to_parsed()["equations"]]
+    ['((x ^ 2) + y) = 3']
+    """
+    __slots__ = ("opcodes", "left", "right", "payload", "names", "big_constants", "equations", "constraints")
+
+    def __init__(self):
+        self.opcodes = array("b")
+        self.left = array("i")
+        self.right = array("i")
+        self.payload = array("q")
+        self.names = []
+        self.big_constants = []
+        self.equations = array("i")
+        self.constraints = array("i")
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def nbytes(self):
+        '''
+        Memory used by the arrays of the nodes, in bytes
+        '''
+        arrays = (self.opcodes, self.left, self.right, self.payload, self.equations, self.constraints)
+        return sum(len(values) * values.itemsize for values in arrays)
+
+    def add(self, opcode, left=-1, right=-1, payload=0):
+        self.opcodes.append(opcode)
+        self.left.append(left)
+        self.right.append(right)
+        self.payload.append(payload)
+        return len(self.opcodes) - 1
+
+    # conversions
+
+    @staticmethod
+    def from_parsed(parsed):
+        flat = FlatProblem()
+        indices = {}
+        name_indices = {}
+
+        def flatten(root):
+            # iterative post-order traversal, children are added before their parents
+            stack = [(root, False)]
+            while stack:
+                node, children_done = stack.pop()
+                if id(node) in indices:
+                    continue
+                if isinstance(node, Variable):
+                    if node.name not in name_indices:
+                        name_indices[node.name] = len(flat.names)
+                        flat.names.append(node.name)
+                    indices[id(node)] = flat.add(VARIABLE, payload=name_indices[node.name])
+                elif isinstance(node, Constant):
+                    if INT64_MIN <= node.value <= INT64_MAX:
+                        indices[id(node)] = flat.add(CONSTANT, payload=node.value)
+                    else:
+                        flat.big_constants.append(node.value)
+                        indices[id(node)] = flat.add(BIG_CONSTANT, payload=len(flat.big_constants) - 1)
+                elif children_done:
+                    left, right = indices[id(node.left_expression)], indices[id(node.right_expression)]
+                    indices[id(node)] = flat.add(CLASSES[type(node)], left, right)
+                else:
+                    stack.append((node, True))
+                    stack.append((node.right_expression, False))
+                    stack.append((node.left_expression, False))
+            return indices[id(root)]
+
+        for equation in parsed["equations"]:
+            flat.equations.append(flatten(equation))
+        for constraint in parsed["constraints"]:
+            flat.constraints.append(flatten(constraint))
+        return flat
+
+    def to_parsed(self):
+        nodes = []
+        for index in range(len(self.opcodes)):
+            opcode = self.opcodes[index]
+            if opcode == VARIABLE:
+                nodes.append(Variable(self.names[self.payload[index]]))
+            elif opcode == CONSTANT:
+                nodes.append(Constant(self.payload[index]))
+            elif opcode == BIG_CONSTANT:
+                nodes.append(Constant(self.big_constants[self.payload[index]]))
+            else:
+                nodes.append(OPCODE_CLASSES[opcode](nodes[self.left[index]], nodes[self.right[index]]))
+        return {
+            "equations": [nodes[index] for index in self.equations],
+            "constraints": [nodes[index] for index in self.constraints]
+        }
+
+    # passes over the arrays
+
+    def constant(self, index):
+        if self.opcodes[index] == BIG_CONSTANT:
+            return self.big_constants[self.payload[index]]
+        return self.payload[index]
+
+    def toz3(self, ctx=None):
+        '''
+        Returns the z3 terms of all the equations and constraints
+        '''
+        variables = [z3.Int(name, ctx) for name in self.names]
+        terms = []
+        for index in range(len(self.opcodes)):
+            opcode = self.opcodes[index]
+            if opcode == VARIABLE:
+                terms.append(variables[self.payload[index]])
+                continue
+            if opcode in (CONSTANT, BIG_CONSTANT):
+                terms.append(z3.IntVal(self.constant(index), ctx))
+                continue
+            if opcode == POWER:
+                # the right child is the constant exponent
+                terms.append(power_term(terms[self.left[index]], self.constant(self.right[index])))
+                continue
+            left, right = terms[self.left[index]], terms[self.right[index]]
+            if opcode == ADDITION:
+                terms.append(left + right)
+            elif opcode == MULTIPLICATION:
+                terms.append(left * right)
+            elif opcode == EQUATION:
+                terms.append(left == right)
+            elif opcode == GREATER_THAN:
+                terms.append(left > right)
+            elif opcode == LESS_THAN:
+                terms.append(left < right)
+            elif opcode == CONJUNCTION:
+                terms.append(z3.And(left, right))
+            else:
+                terms.append(z3.Or(left, right))
+        return [terms[index] for index in self.equations] + [terms[index] for index in self.constraints]
+
+    def evaluate_roots(self, variable_values):
+        '''
+        Returns the truth value of every equation and constraint for the given variable values
+        '''
+        values = []
+        for index in range(len(self.opcodes)):
+            opcode = self.opcodes[index]
+            if opcode == VARIABLE:
+                values.append(variable_values[self.names[self.payload[index]]])
+                continue
+            if opcode in (CONSTANT, BIG_CONSTANT):
+                values.append(self.constant(index))
+                continue
+            left, right = values[self.left[index]], values[self.right[index]]
+            if opcode == ADDITION:
+                values.append(left + right)
+            elif opcode == MULTIPLICATION:
+                values.append(left * right)
+            elif opcode == POWER:
+                values.append(left ** right)
+            elif opcode == EQUATION:
+                values.append(left == right)
+            elif opcode == GREATER_THAN:
+                values.append(left > right)
+            elif opcode == LESS_THAN:
+                values.append(left < right)
+            elif opcode == CONJUNCTION:
+                values.append(left and right)
+            else:
+                values.append(left or right)
+        return [values[index] for index in self.equations] + [values[index] for index in self.constraints]
+
+    def evaluate(self, variable_values):
+        '''
+        Returns True if the variable values satisfy every equation and constraint
+        '''
+        return all(self.evaluate_roots(variable_values))
+
+    # pickling sends the raw arrays
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
@@ -0,0 +1,157 @@
+from polynomial import Polynomial
+
+# Exact solver for systems of linear diophantine equations
+#
+# A system A x = b without constraints is solved with integer linear algebra
+# instead of z3: A is brought to column Hermite normal form H = A U with a
+# unimodular matrix U, H y = b is solved by forward substitution and the
+# solutions are x = U y. The columns of U past the rank of A are an integer
+# basis of the lattice of solutions of A x = 0.
+
+def linear_system(equations):
+    """
+    Builds the integer matrix A and vector b of a system of linear Equations as A x = b.
+    Returns (variable names, A, b), or None if some equation is not linear.
+
+    Example:
+    >>> from parsers import ParseDiophantine
+    >>> linear_system(ParseDiophantine().parse_problem("Solve x + y + z = 10, x - z = 5.")["equations"])
+    (['x', 'y', 'z'], [[1, 1, 1], [1, 0, -1]], [10, 5])
+    """
+    rows = []
+    names = set()
+    for equation in equations:
+        polynomial = Polynomial.from_relation(equation)
+        if not polynomial.is_linear():
+            return None
+        coefficients = {monomial[0][0]: coefficient for monomial, coefficient in polynomial.terms.items() if monomial != ()}
+        names |= set(coefficients)
+        rows.append((coefficients, -polynomial.constant()))
+
+    names = sorted(names)
+    matrix = [[coefficients.get(name, 0) for name in names] for coefficients, constant in rows]
+    rhs = [constant for coefficients, constant in rows]
+    return names, matrix, rhs
+
+def extended_gcd(a, b):
+    '''
+    Returns (g, s, t) with g = gcd(a, b) >= 0 and s*a + t*b = g
+    '''
+    old_r, r = a, b
+    old_s, s = 1, 0
+    old_t, t = 0, 1
+    while r != 0:
+        quotient = old_r // r
+        old_r, r = r, old_r - quotient * r
+        old_s, s = s, old_s - quotient * s
+        old_t, t = t, old_t - quotient * t
+    if old_r < 0:
+        return -old_r, -old_s, -old_t
+    return old_r, old_s, old_t
+
+def hermite_column_form(matrix, columns):
+    """
+    Returns (H, U, pivots) with H = matrix * U in column echelon form, U unimodular and pivots
+    the list of (row, column) positions of the pivots of H, one per column up to the rank.
+
+    Example:
+    >>> H, U, pivots = hermite_column_form([[2, 4, 6]], 3)
+    >>> H, pivots
+    ([[2, 0, 0]], [(0, 0)])
+    """
+    H = [list(row) for row in matrix]
+    U = [[int(i == j) for j in range(columns)] for i in range(columns)]
+    pivots = []
+    rank = 0
+
+    def combine(i, j, a, b, c, d):
+        # column_i, column_j <- a*column_i + b*column_j, c*column_i + d*column_j
+        for rows in (H, U):
+            for row in rows:
+                row[i], row[j] = a * row[i] + b * row[j], c * row[i] + d * row[j]
+
+    for row in range(len(H)):
+        if rank == columns:
+            break
+        for column in range(rank + 1, columns):
+            a, b = H[row][rank], H[row][column]
+            if b == 0:
+                continue
+            g, s, t = extended_gcd(a, b)
+            # unimodular: s*(a/g) + t*(b/g) = 1
+            combine(rank, column, s, t, -b // g, a // g)
+        if H[row][rank] != 0:
+            if H[row][rank] < 0:
+                for rows in (H, U):
+                    for current_row in rows:
+                        current_row[rank] = -current_row[rank]
+            pivots.append((row, rank))
+            rank += 1
+
+    return H, U, pivots
+
+def solve_linear_system(matrix, rhs, columns):
+    """
+    Solves A x = b over the integers. Returns None if there is no integer solution, otherwise
+    (particular solution, basis) where every solution is the particular one plus an integer
+    combination of the basis vectors.
+
+    Examples:
+    >>> solve_linear_system([[2, 4]], [6], 2)
+    ([3, 0], [[-2, 1]])
+    >>> print(solve_linear_system([[2, 4]], [5], 2))
+    None
+    """
+    H, U, pivots = hermite_column_form(matrix, columns)
+    pivot_columns = dict(pivots)
+    y = [0] * columns
+
+    for row in range(len(H)):
+        # columns after the current pivot are zero in this row
+        remainder = rhs[row] - sum(H[row][column] * y[column] for column in range(columns))
+        if row in pivot_columns:
+            column = pivot_columns[row]
+            if remainder % H[row][column] != 0:
+                return None
+            y[column] = remainder // H[row][column]
+        elif remainder != 0:
+            return None
+
+    particular = [sum(U[i][j] * y[j] for j in range(columns)) for i in range(columns)]
+    basis = [[U[i][j] for i in range(columns)] for j in range(len(pivots), columns)]
+    return particular, basis
+
+def solve_linear_problem(parsed):
+    """
+    Solves a parsed problem exactly if it only has linear equations and no constraints.
+    Returns None when the problem has to be handed to z3, otherwise a dictionary with
+    the status, the model (a particular solution) and the lattice basis of the solutions
+    as a list of {variable name: coefficient}.
+
+    Examples:
+    >>> from parsers import ParseDiophantine
+    >>> parser = ParseDiophantine()
+    >>> solve_linear_problem(parser.parse_problem("Solve x + y + z = 10, x - z = 5."))
+    {'status': 'sat', 'model': {'x': 0, 'y': 15, 'z': -5}, 'basis': [{'x': -1, 'y': 2, 'z': -1}]}
+    >>> solve_linear_problem(parser.parse_problem("Solve 2x + 4y = 5."))
+    {'status': 'unsat', 'model': None, 'basis': None}
+    >>> print(solve_linear_problem(parser.parse_problem("Solve x*y = 5.")))
+    None
+    """
+    if parsed["constraints"]:
+        return None
+    system = linear_system(parsed["equations"])
+    if system is None:
+        return None
+
+    names, matrix, rhs = system
+    solution = solve_linear_system(matrix, rhs, len(names))
+    if solution is None:
+        return {"status": "unsat", "model": None, "basis": None}
+
+    particular, basis = solution
+    return {
+        "status": "sat",
+        "model": dict(zip(names, particular)),
+        "basis": [dict(zip(names, vector)) for vector in basis]
+    }
@@ -1,12 +1,27 @@
-from symbolic_classes import OrUnion, Conjunction, Addition, Multiplication, Constant, Variable, Equation, LessThan, GreaterThan
-from string_formatter import *
-from z3 import *
+import re
+
+from symbolic_classes import OrUnion, Conjunction, Addition, Multiplication, Power, Constant, Variable, Equation, LessThan, GreaterThan, NodeFactory
 
 # Parsers from the lectures
+#
+# The parsers work over a shared buffer (Input) and an offset into it: parse_at
+# returns [(result, next_position)] or [] and never copies the string. The
+# lecture-style parse(string) is kept on top of it and returns
+# [(result, rest_of_string)].
 
 result = lambda p: p[0][0]
 rest   = lambda p: p[0][1]
 
+class Input:
+    """
+    Shared buffer for the parsers. With memoize=True every (parser, position)
+    pair is parsed at most once (packrat parsing), so backtracking in OrElse
+    or repeated probes at the same position are answered from the memo table.
+    """
+    def __init__(self, string, memoize=False):
+        self.string = string
+        self.memo = {} if memoize else None
+
 class Parser:
     def __rshift__(self, other):
         return Seq(self, other)
@@ -15,7 +30,22 @@ class Parser:
         return OrElse(self, other)
     
     def parse(self, inp):
-        return self.parser.parse(inp)
+        buffer = inp if isinstance(inp, Input) else Input(inp)
+        p = self.run(buffer, 0)
+        if p == []:
+            return []
+        return [(result(p), buffer.string[rest(p):])]
+
+    def run(self, inp, position):
+        if inp.memo is None:
+            return self.parse_at(inp, position)
+        key = (self, position)
+        if key not in inp.memo:
+            inp.memo[key] = self.parse_at(inp, position)
+        return inp.memo[key]
+
+    def parse_at(self, inp, position):
+        return self.parser.run(inp, position)
 
     def cons(x, xs):
         if type(x) == str and xs == []:
@@ -29,61 +59,93 @@ class Seq(Parser):
         self.parser   = parser
         self.and_then = and_then
 
-    def parse(self, inp):
-        p = self.parser.parse(inp)
+    def parse_at(self, inp, position):
+        p = self.parser.run(inp, position)
         if p != []:
-            return self.and_then(result(p)).parse(rest(p))
+            return self.and_then(result(p)).run(inp, rest(p))
 
         return []
+
+class Chain(Parser):
+    """
+    Runs the given parsers one after the other and returns the list of their results.
+    Unlike Seq, no parser is built while parsing.
+    """
+    def __init__(self, *parsers):
+        self.parsers = parsers
+
+    def parse_at(self, inp, position):
+        results = []
+        for parser in self.parsers:
+            p = parser.run(inp, position)
+            if p == []:
+                return []
+            results.append(result(p))
+            position = rest(p)
+        return [(results, position)]
     
 class OrElse(Parser):
     def __init__(self, parser1, parser2):
         self.parser1 = parser1
         self.parser2 = parser2
 
-    def parse(self, inp):
-        p = self.parser1.parse(inp)
+    def parse_at(self, inp, position):
+        p = self.parser1.run(inp, position)
         if p != []:
             return p
 
-        return self.parser2.parse(inp)
+        return self.parser2.run(inp, position)
     
 class ParseItem(Parser):
-    def parse(self, inp):
-        if inp == "":
+    def parse_at(self, inp, position):
+        if position >= len(inp.string):
             return []
-        return [(inp[0], inp[1:])]
+        return [(inp.string[position], position + 1)]
     
 class Return(Parser):
     def __init__(self, x):
         self.x = x
         
-    def parse(self, inp):
-        return [(self.x, inp)]
+    def parse_at(self, inp, position):
+        return [(self.x, position)]
 
 class Fail(Parser):
-    def parse(self, inp):
+    def parse_at(self, inp, position):
         return []
     
 class ParseSome(Parser):
     def __init__(self, parser):
-        self.parser = parser >> (lambda x: \
-                                 (ParseSome(parser) ^ Return([])) >> (lambda xs: \
-                                 Return(Parser.cons(x, xs))))
+        self.parser = parser
+
+    def parse_at(self, inp, position):
+        results = []
+        p = self.parser.run(inp, position)
+        while p != []:
+            results.append(result(p))
+            position = rest(p)
+            p = self.parser.run(inp, position)
+        if results == []:
+            return []
+        if all(type(x) == str for x in results):
+            return [("".join(results), position)]
+        return [(results, position)]
         
 class ParseIf(Parser):
     def __init__(self, pred):
-        self.pred   = pred
-        self.parser = ParseItem() >> (lambda c: \
-                                      Return(c) if self.pred(c) else Fail())
+        self.pred = pred
+
+    def parse_at(self, inp, position):
+        if position < len(inp.string) and self.pred(inp.string[position]):
+            return [(inp.string[position], position + 1)]
+        return []
         
-class ParseChar(Parser):
+class ParseChar(ParseIf):
     def __init__(self, c):
-        self.parser = ParseIf(lambda x: c == x)
+        super().__init__(lambda x: c == x)
         
-class ParseDigit(Parser):
+class ParseDigit(ParseIf):
     def __init__(self):
-        self.parser = ParseIf(lambda c: c in "0123456789")
+        super().__init__(lambda c: c in "0123456789")
 
 # Parsers for the project
 
@@ -93,391 +155,450 @@ class ParseKeyword(Parser):
 
     Example:
     >>> print(result(ParseKeyword("art").parse("artificial intelligence")))
-    'art'
+    art
     """
     def __init__(self, keyword):
         self.keyword = keyword
-        self.parser = ParseChar(self.keyword[0]) >> (lambda x: \
-                                                (ParseKeyword(self.keyword[1:]) if len(self.keyword) > 1 else Return([])) >> (lambda xs: \
-                                                    Return(Parser.cons(x, xs))))
-        
-class ParseDiophantine():
-    def __init__(self):
-        self.ws_p = ParseChar(" ")
-        self.line_break_p = ParseKeyword("\n")
-        self.lp_p = ParseChar("(")
-        self.rp_p = ParseChar(")")
-        self.comma_p = ParseChar(",")
-        self.dot_p = ParseChar(".")
-        self.great_p = ParseChar(">")
-        self.less_p = ParseChar("<")
-        self.digit_p = ParseDigit()
-        self.and_p = ParseKeyword("and")
-        self.or_p = ParseKeyword("or")
-        self.solve_p = ParseKeyword("Solve")
-        self.st_p = ParseKeyword("such that")
-
-    # Helper functions to parse problems to the symbolic classes
-
-    def parse_var_cons(self, string):
-        is_negative = False
-        rest_string = string
-
-        if rest_string[0] == '-':
-            is_negative = True
-            rest_string = rest_string[1:]
-    
-        if self.digit_p.parse(rest_string) != []:
-            full_integer = result(self.digit_p.parse(rest_string))
-            rest_string = rest(self.digit_p.parse(rest_string))
-            # loop to get full integer
-            while self.digit_p.parse(rest_string) != []:
-                full_integer = full_integer + result(self.digit_p.parse(rest_string))
-                rest_string = rest(self.digit_p.parse(rest_string))
-
-            constant_value = int(full_integer)
-            if is_negative: constant_value = -constant_value
-            term = Constant(constant_value)
-        elif self.lp_p.parse(rest_string) != []:
-            closing_parenthesis_finder = self.find_closing_parenthesis(rest_string)
-            closing_parenthesis = closing_parenthesis_finder["closing_parenthesis"]
-            term = self.parse_expression(rest_string[1:closing_parenthesis])
-            if is_negative: term = Multiplication(Constant(-1), term)
-            rest_string = rest_string[closing_parenthesis + 1:]
-        else:
-            name = rest_string[0]
-            term = Variable(name)
-            if is_negative: term = Multiplication(Constant(-1), term)
-            rest_string = rest_string[1:]
 
-        return [(term, rest_string)]
+    def parse_at(self, inp, position):
+        if inp.string.startswith(self.keyword, position):
+            return [(self.keyword, position + len(self.keyword))]
+        return []
 
+class ParseError(ValueError):
+    """
+    Raised when a problem description does not follow the grammar in grammar.md
+    """
+    def __init__(self, message, offset=None):
+        if offset is not None:
+            message = f"{message} (at offset {offset})"
+        super().__init__(message)
+        self.offset = offset
+
+# Tokenizer
+#
+# The whole problem description is scanned once into a list of tokens.
+# Each token is a tuple (kind, value, offset) where offset is the index of
+# the token in the original string, used for error messages.
+
+SYMBOLS = {
+    "+": "PLUS", "-": "MINUS", "*": "TIMES", "^": "POWER",
+    "(": "LP", ")": "RP",
+    "=": "EQ", ">": "GREATER", "<": "LESS",
+    ",": "COMMA", ".": "DOT",
+}
+KEYWORDS = {"Solve": "SOLVE", "and": "AND", "or": "OR"}
+KEYWORD_INITIALS = "Saos"
+
+# Parsers used by the tokenizer, built once and run over the shared buffer
+number_p    = ParseSome(ParseDigit())
+keyword_p   = ParseKeyword("Solve") ^ ParseKeyword("and") ^ ParseKeyword("or")
+such_that_p = Chain(ParseKeyword("such"), ParseSome(ParseIf(str.isspace)), ParseKeyword("that"))
+
+def tokenize(string, base=0):
+    """
+    Splits a problem description into tokens in a single pass. White spaces and
+    line breaks are skipped, keywords may appear glued to other letters
+    (e.g. "5orx<0") and every other letter is a single-letter variable.
+    Offsets start at base, for strings that are a part of a larger input.
 
+    Example:
+    >>> [kind for kind, value, offset in tokenize("Solve 2x - z = 5.")]
+    ['SOLVE', 'INT', 'VAR', 'MINUS', 'VAR', 'EQ', 'INT', 'DOT', 'END']
+    """
+    tokens = []
+    buffer = Input(string)
+    position = 0
+    length = len(string)
 
-    def parse_operation(self, string, addition=True, multiplication=True):
-        '''
-        Helper function which parses binary operator and returns the appropriate class and the rest of the string
-        '''
-        rest_position = 0
-        rest_string = string
-
-        while len(rest_string) > 1:
-            rest_string = string[rest_position:]
-
-            # if there is a parenthesis, return the closing parenthesis position and the next operator (if any)
-            # This intends to just return operators in the current level of the parsing tree
-            if self.lp_p.parse(rest_string) != []:
-                closing_parenthesis_finder = self.find_closing_parenthesis(string[rest_position:])
-                closing_parenthesis = closing_parenthesis_finder["closing_parenthesis"]
-                next_operator = closing_parenthesis_finder["next_operator"]
-                if next_operator != []:
-                    return [(result(next_operator), string[closing_parenthesis + 1:]), closing_parenthesis + 1]
-                else:
-                    return []
-        
-            if (multiplication):
-                # multiplication: positive integer, opening parenthesis or '*' symbol
-                # In first two cases operates "as if the symbol were invisible" and returns the same string as rest
-                if rest_string[0] == '*':
-                    return [(Multiplication(), rest_string[1:]), rest_position + 1]
-            
-            if (addition):
-                # addition: '-' or '+' symbol
-                # first case returns the whole string as rest
-                if rest_string[0] == '-':
-                    return [(Addition(), rest_string), rest_position + 1]
-                elif rest_string[0] == '+':
-                    return [(Addition(), rest_string[1:]), rest_position + 1]
-
-            rest_position += 1
-        # If it's none from the above, then there is no further operator
-        return []
-            
-    def find_closing_parenthesis(self, string):
-        '''
-        This helper function returns the position of the closing parenthesis
-        and the next operator (if any)
-        '''
-        l_parenthesis = 0
-        r_parenthesis = 0
-        position = 0
-
-        for c in string:
-            if c == '(': l_parenthesis += 1
-            if c == ')': r_parenthesis += 1
-
-            if l_parenthesis == r_parenthesis:
-                # evaluate position is not the last character
-                if position < len(string) - 1:
-                    # if the next character is an operator, return it
-                    if self.parse_operation(string[position + 1:]) != []:
-                        return {
-                            "closing_parenthesis": position,
-                            "next_operator": self.parse_operation(string[position + 1:])
-                        } 
-                return {
-                    "closing_parenthesis": position,
-                    "next_operator": []
-                }
-            position += 1
-            
+    while position < length:
+        current_character = string[position]
 
-    def parse_expression(self, string):
-        # If there is a parenthesis, apply recursively
-        if self.lp_p.parse(string) != []:
-            closing_parenthesis_finder = self.find_closing_parenthesis(string)
-            closing_parenthesis = closing_parenthesis_finder["closing_parenthesis"]
-            next_operator = closing_parenthesis_finder["next_operator"]
-
-            # if there is no further operator, return the expression inside the parenthesis
-            if next_operator == []:
-                return self.parse_expression(string[1:closing_parenthesis])
+        if current_character.isspace():
+            position += 1
+        elif current_character in SYMBOLS:
+            tokens.append((SYMBOLS[current_character], current_character, base + position))
+            position += 1
+        elif current_character.isdigit():
+            p = number_p.run(buffer, position)
+            tokens.append(("INT", int(result(p)), base + position))
+            position = rest(p)
+        elif current_character in KEYWORD_INITIALS:
+            p = such_that_p.run(buffer, position)
+            if p != []:
+                tokens.append(("SUCH_THAT", "such that", base + position))
+                position = rest(p)
+                continue
+            p = keyword_p.run(buffer, position)
+            if p != []:
+                tokens.append((KEYWORDS[result(p)], result(p), base + position))
+                position = rest(p)
             else:
-                operator = result(next_operator)            
-            # If operator is Addition, parse the right expression
-            if isinstance(operator, Addition):
-                operator.left_expression = self.parse_expression(string[1:closing_parenthesis])
-                operator.right_expression = self.parse_expression(string[closing_parenthesis + 1:])
-                return operator
-            # If operator is Multiplication, look for an operator with higher precedence
-            elif isinstance(operator, Multiplication):
-                next_addition = self.parse_operation(string[closing_parenthesis + 1:], multiplication=False)
-                # If there is no further sum operator, return the expression inside the parenthesis
-                if next_addition == []:
-                    operator.right_expression = self.parse_expression(string[closing_parenthesis + 1:])
-                    return operator
-                # If there is a further operator and it is Addition, return the addition with the multiplication as left expression
-                else:
-                    if isinstance(result(next_addition), Addition):
-                        expression_end = next_addition[1]
-                        next_addition = result(next_addition)
-                        operator.right_expression = self.parse_expression(string[closing_parenthesis + 1:expression_end])
-                        next_addition.left_expression = operator
-                        next_addition.right_expression = self.parse_expression(string[expression_end + 1:])
-                        return next_addition
+                tokens.append(("VAR", current_character, base + position))
+                position += 1
+        elif current_character.isalpha():
+            tokens.append(("VAR", current_character, base + position))
+            position += 1
         else:
-            # Expressions should start with constants or variables (after dealing with parenthesis and white spaces)
-            term = result(self.parse_var_cons(string))
-            rest_string = rest(self.parse_var_cons(string))
+            raise ParseError(f"Unexpected character {current_character!r}", base + position)
+
+    tokens.append(("END", None, base + length))
+    return tokens
+
+def match_parentheses(tokens):
+    '''
+    Returns a dictionary mapping the index of every '(' token to the index of its ')'
+    '''
+    matches = {}
+    open_parentheses = []
+    for index, (kind, value, offset) in enumerate(tokens):
+        if kind == "LP":
+            open_parentheses.append(index)
+        elif kind == "RP":
+            if open_parentheses == []:
+                raise ParseError("Unbalanced ')'", offset)
+            matches[open_parentheses.pop()] = index
+    if open_parentheses != []:
+        raise ParseError("Unbalanced '('", tokens[open_parentheses[-1]][2])
+    return matches
+
+# Binary operators with their node class and precedence. All of them are right-associative,
+# e.g. x + y + z is (x + (y + z)); comparisons and '=' cannot be chained (see check_operands)
+OPERATORS = {
+    "EQ": (Equation, 0),
+    "OR": (OrUnion, 1),
+    "AND": (Conjunction, 2),
+    "GREATER": (GreaterThan, 3), "LESS": (LessThan, 3),
+    "PLUS": (Addition, 4),
+    "TIMES": (Multiplication, 5),
+}
+NEGATION_PRECEDENCE = 6
+ARITHMETIC_CLASSES = (Variable, Constant, Addition, Multiplication, Power)
+BOOLEAN_CLASSES = (Conjunction, OrUnion, GreaterThan, LessThan)
+
+# Streaming
+#
+# Equations and constraints are separated by ',' and the problem ends with '.', and
+# neither can appear inside an equation or a constraint. A problem can therefore be
+# cut into statements as it is read, each of them holding a single equation or
+# constraint (or the last equation, 'such that' and the first constraint), and each
+# statement can be parsed on its own.
+
+CHUNK_SIZE = 2 ** 16
+TERMINATOR = re.compile("[,.]")
+
+def read_chunks(path, chunk_size=CHUNK_SIZE):
+    '''
+    Yields the text of a file in chunks of chunk_size characters
+    '''
+    with open(path) as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if chunk == "":
+                return
+            yield chunk
+
+def read_statements(chunks):
+    """
+    Cuts a stream of text chunks into statements, yielding (text, offset of the text,
+    terminator) where the terminator is ',' or '.', or None for the text after the last one.
+    Only the statement being read is kept in memory.
 
-            operator_parser = self.parse_operation(rest_string)
+    Example:
+    >>> list(read_statements(["Solve x = 1, ", "y", " = 2."]))
+    [('Solve x = 1', 0, ','), (' y = 2', 12, '.'), ('', 19, None)]
+    """
+    pending = []
+    pending_offset = 0
+    chunk_offset = 0
+    for chunk in chunks:
+        start = 0
+        for match in TERMINATOR.finditer(chunk):
+            pending.append(chunk[start:match.start()])
+            yield "".join(pending), pending_offset, match.group()
+            pending = []
+            start = match.end()
+            pending_offset = chunk_offset + start
+        pending.append(chunk[start:])
+        chunk_offset += len(chunk)
+    yield "".join(pending), pending_offset, None
+
+# Tokens that can start a factor, two consecutive factors are an implicit multiplication
+FACTOR_START = ("INT", "VAR", "LP")
+
+def check_operands(cls, operands, offset):
+    # arithmetic and comparisons take expressions, 'and' and 'or' take comparisons
+    expected = BOOLEAN_CLASSES if cls in (Conjunction, OrUnion) else ARITHMETIC_CLASSES
+    for operand in operands:
+        if not isinstance(operand, expected):
+            kind = "a comparison" if expected is BOOLEAN_CLASSES else "an expression"
+            raise ParseError(f"Expected {kind} around {cls.__name__}", offset)
 
-            # If there is no operator, return the term
-            if operator_parser == []:
-                return term
-            else:
-                operator = result(operator_parser)
-                rest_string = rest(operator_parser)
-                # If the operator is an Addition, parse the right expression
-                if isinstance(operator, Addition):
-                    operator.left_expression = term
-                    operator.right_expression = self.parse_expression(rest_string)
-                    return operator
-                # If the operator is a Multiplication, look for an operator with higher precedence
-                elif isinstance(operator, Multiplication):
-                    next_addition = self.parse_operation(rest_string, multiplication=False)
-                    # If there is no further sum operator, parse the right expression and return the multiplication
-                    if next_addition == []:
-                        operator.left_expression = term
-                        operator.right_expression = self.parse_expression(rest_string)
-                        return operator
-                    # If there is a further operator and it is Addition, return the addition with the multiplication as left expression
-                    else:
-                        expression_end = next_addition[1]
-                        next_addition = result(next_addition)
-                        operator.left_expression = term
-                        operator.right_expression = self.parse_expression(rest_string[:expression_end])
-                        next_addition.left_expression = operator
-                        next_addition.right_expression = self.parse_expression(rest_string[expression_end:])
-                        return next_addition
-                    
-    def parse_equation(self, string):
-        # Position of the equal sign
-        equal_position = string.find('=')
-        left_expression = self.parse_expression(format_string(string[:equal_position]))
-        right_expression = self.parse_expression(format_string(string[equal_position + 1:]))
-        return Equation(left_expression, right_expression)
-    
-    def search_in_same_level(self, string, parser):
-        l_parenthesis = 0
-        r_parenthesis = 0
-        position = 0
-
-        while position < len(string):
-            if string[position] == '(': l_parenthesis += 1
-            if string[position] == ')': r_parenthesis += 1
-
-            if l_parenthesis == r_parenthesis:
-                if parser.parse(string[position:]) != []:
-                    return position
-            position += 1
-        return None
-    
-    def parse_constraint(self, string):
-        if len(string) < 1: return ""
-        # if there are parenthesis, apply recursively
-        if self.lp_p.parse(string) != []:
-            closing_parenthesis_finder = self.find_closing_parenthesis(string)
-            closing_parenthesis = closing_parenthesis_finder["closing_parenthesis"]
-
-            # parse operator after the parenthesis
-            if self.and_p.parse(string[closing_parenthesis + 1:]) != []:
-                operator = result(self.and_p.parse(string[closing_parenthesis + 1:]))
-                rest_string = rest(self.and_p.parse(string[closing_parenthesis + 1:]))
-            elif self.or_p.parse(string[closing_parenthesis + 1:]) != []:
-                operator = result(self.or_p.parse(string[closing_parenthesis + 1:]))
-                rest_string = rest(self.or_p.parse(string[closing_parenthesis + 1:]))
+class ParseDiophantine():
+    """
+    Parses problem descriptions (see grammar.md) to the symbolic classes.
+    The input is tokenized once and then parsed in a single pass over the tokens
+    by operator precedence with explicit stacks (no recursion, so parentheses may be
+    nested arbitrarily deep), with '^' binding tighter than '*', '*' binding tighter
+    than '+'/'-' and 'and' binding tighter than 'or'. Chains of the same operator are
+    right-leaning, e.g. x + y + z is (x + (y + z)). Nodes are built through a NodeFactory
+    (one per parsed string), so identical subexpressions of a problem are shared and
+    repeated factors are normalized into powers, e.g. x*x*x is (x ^ 3).
+
+    Example:
+    >>> parsed = ParseDiophantine().parse_problem("Solve 2x - z = 5 such that x > 0 or z < 0 and x < 3.")
+    >>> print(parsed["equations"][0])
+    ((2 * x) + (-1 * z)) = 5
+    >>> print(parsed["constraints"][0])
+    ((x > 0) or ((z < 0) and (x < 3)))
+    >>> print(ParseDiophantine().parse_expression("(" * 5000 + "x - 1" + ")" * 5000))
+    (x + -1)
+    >>> print(ParseDiophantine().parse_expression("-2^2 + 3x*x*x*y - (x + 1)^2"))
+    ((-1 * (2 ^ 2)) + ((3 * ((x ^ 3) * y)) + (-1 * ((x + 1) ^ 2))))
+    """
+    def __init__(self):
+        self.tokens = []
+        self.position = 0
+        self.factory = NodeFactory()
+
+    # Helper functions to move along the tokens
+
+    def start(self, string, base=0):
+        self.tokens = tokenize(string, base)
+        self.position = 0
+        match_parentheses(self.tokens)
+        self.factory = NodeFactory()
+
+    def peek(self, offset=0):
+        return self.tokens[min(self.position + offset, len(self.tokens) - 1)][0]
+
+    def accept(self, kind):
+        if self.peek() == kind:
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, kind):
+        token_kind, value, offset = self.tokens[self.position]
+        if token_kind != kind:
+            found = "end of input" if token_kind == "END" else repr(value)
+            raise ParseError(f"Expected {kind} but found {found}", offset)
+        self.position += 1
+        return value
+
+    # Operator precedence parsing
+
+    def reduce(self, operands, operators, precedence):
+        # applies the stacked operators binding tighter than precedence
+        while operators and operators[-1][0] != "LP" and operators[-1][1] > precedence:
+            kind, operator_precedence, offset = operators.pop()
+            if kind == "NEG":
+                operand = operands.pop()
+                check_operands(Multiplication, [operand], offset)
+                operands.append(self.factory.make(Multiplication, self.factory.make(Constant, -1), operand))
+                continue
+            cls = OPERATORS[kind][0]
+            right_expression = operands.pop()
+            left_expression = operands.pop()
+            check_operands(cls, [left_expression, right_expression], offset)
+            if cls is Multiplication:
+                operands.append(self.factory.multiply(left_expression, right_expression))
             else:
-                return self.parse_constraint(string[1:closing_parenthesis]) # if no operator, return the expression inside the parenthesis
-            
-            # parse left expression
-            if operator == 'or':
-                operator_instance = OrUnion()
-                operator_instance.left_expression = self.parse_constraint(string[1:closing_parenthesis])
-                operator_instance.right_expression = self.parse_constraint(rest_string)
-                return operator_instance
-            elif operator == 'and':
-                operator_instance = Conjunction()
-                # We need to know if there will be any further or operator in the right expression
-                next_or_position = self.search_in_same_level(rest_string, self.or_p)
-                if next_or_position == None:
-                    # There is no operator of higher precedence, so the right expression is the rest of the string
-                    operator_instance.left_expression = self.parse_constraint(string[1:closing_parenthesis])
-                    operator_instance.right_expression = self.parse_constraint(rest_string)
-                    return operator_instance
-                else:
-                    # There is an operator of higher precedence, so the right expression is the string until that operator
-                    operator_instance.left_expression = self.parse_constraint(string[1:closing_parenthesis])
-                    operator_instance.right_expression = self.parse_constraint(rest_string[:next_or_position])
-                    # The next operator is an or, so we need to parse it recursively
-                    next_operator = OrUnion()
-                    next_operator.left_expression = operator_instance
-                    next_operator.right_expression = self.parse_constraint(rest_string[next_or_position + 2:])
-                    return next_operator
+                operands.append(self.factory.make(cls, left_expression, right_expression))
 
-        else:
-            # Expressions should start with constants or variables (after dealing with parenthesis and white spaces)
-            term = result(self.parse_var_cons(string))
-            rest_string = rest(self.parse_var_cons(string))
-            # greater than or less than symbol
-            if self.great_p.parse(rest_string) != []:
-                second_term = result(self.parse_var_cons(rest_string[1:]))
-                rest_string = rest(self.parse_var_cons(rest_string[1:]))
-                inequality = GreaterThan(term, second_term)
-            elif self.less_p.parse(rest_string) != []:
-                second_term = result(self.parse_var_cons(rest_string[1:]))
-                rest_string = rest(self.parse_var_cons(rest_string[1:]))
-                inequality = LessThan(term, second_term)
-            
-            if len(rest_string)<1: return inequality
-            elif self.or_p.parse(rest_string) != []:
-                operator_instance = OrUnion()
-                operator_instance.left_expression = inequality
-                operator_instance.right_expression = self.parse_constraint(rest_string[2:])
-                return operator_instance
-            elif self.and_p.parse(rest_string) != []:
-                operator_instance = Conjunction()
-                    # We need to know if there will be any further or operator in the right expression
-                next_or_position = self.search_in_same_level(rest_string, self.or_p)
-                if next_or_position == None:
-                    # There is no operator of higher precedence, so the right expression is the rest of the string
-                    operator_instance.left_expression = inequality
-                    operator_instance.right_expression = self.parse_constraint(rest_string[3:])
-                    return operator_instance
+    def parse_operators(self):
+        '''
+        Parses tokens up to the first one that cannot continue the expression outside of
+        parentheses (',', '.', 'such that', the end...) and returns the node built
+        '''
+        operands = []
+        operators = []
+        depth = 0
+        expect_operand = True
+
+        while True:
+            kind, value, offset = self.tokens[self.position]
+            if expect_operand:
+                self.position += 1
+                if kind == "INT":
+                    operands.append(self.factory.make(Constant, value))
+                    expect_operand = False
+                elif kind == "VAR":
+                    operands.append(self.factory.make(Variable, value))
+                    expect_operand = False
+                elif kind == "LP":
+                    operators.append(("LP", None, offset))
+                    depth += 1
+                elif kind == "MINUS" and self.peek() == "INT" and self.peek(1) != "POWER":
+                    operands.append(self.factory.make(Constant, -self.expect("INT")))
+                    expect_operand = False
+                elif kind == "MINUS":
+                    operators.append(("NEG", NEGATION_PRECEDENCE, offset))
                 else:
-                    # There is an operator of higher precedence, so the right expression is the string until that operator
-                    operator_instance.left_expression = inequality
-                    operator_instance.right_expression = self.parse_constraint(rest_string[3:next_or_position])
-                    # The next operator is an or, so we need to parse it recursively
-                    next_operator = OrUnion()
-                    next_operator.left_expression = operator_instance
-                    next_operator.right_expression = self.parse_constraint(rest_string[next_or_position + 2:])
-                    return next_operator
-
-
-    def equations_finder(self, string):
-        position = 0
-        current_equation = ''
-        found_equations = []
-        while position < len(string):
-            current_character = string[position]
-            if self.ws_p.parse(string[position:]) != []:
-                position += 1
-                continue # skip white spaces
-            elif self.line_break_p.parse(string[position:]) != []:
-                position += 1
-                continue # skip line breaks
-            elif self.dot_p.parse(string[position:]) != []:
-                # found '.', return the equations and the rest of the string
-                found_equations.append(current_equation)
-                return {
-                    "found_expressions": found_equations,
-                    "rest_string": string[position + 1:]
-                }
-            elif self.st_p.parse(string[position:]) != []:
-                # found "such that", return the equations and the rest of the string
-                found_equations.append(current_equation)
-                return {
-                    "found_expressions": found_equations,
-                    "rest_string": string[position + 9:]
-                }
-            elif self.comma_p.parse(string[position:]) != []:
-                # found comma, add the equation to the list and reset the current equation
-                found_equations.append(current_equation)
-                current_equation = ''
-                position += 1
+                    found = "end of input" if kind == "END" else repr(value)
+                    raise ParseError(f"Expected a constant, variable or '(' but found {found}", offset)
+            elif kind == "POWER":
+                # exponents are integer literals and '^' binds tightest, so the power
+                # applies to the operand just read
+                self.position += 1
+                if self.peek() != "INT":
+                    raise ParseError("Expected a non-negative integer exponent after '^'", offset)
+                exponent = self.expect("INT")
+                if self.peek() == "POWER":
+                    raise ParseError("Powers cannot be chained, use parentheses", self.tokens[self.position][2])
+                base = operands.pop()
+                check_operands(Power, [base], offset)
+                operands.append(self.factory.power(base, exponent))
+            elif kind in OPERATORS or kind == "MINUS" or kind in FACTOR_START:
+                # '-' is left in place so that the next factor is parsed as a negative one,
+                # two consecutive factors are multiplied
+                operator = "PLUS" if kind == "MINUS" else "TIMES" if kind in FACTOR_START else kind
+                if kind in OPERATORS:
+                    self.position += 1
+                precedence = OPERATORS[operator][1]
+                self.reduce(operands, operators, precedence)
+                operators.append((operator, precedence, offset))
+                expect_operand = True
+            elif kind == "RP" and depth > 0:
+                self.position += 1
+                self.reduce(operands, operators, -1)
+                operators.pop()
+                depth -= 1
             else:
-                current_equation += current_character
-                position += 1
-        # if the end of the string is reached, return the equations and the rest of the string
-        found_equations.append(current_equation)
-        return {
-            "found_expressions": found_equations,
-            "rest_string": ""
-        }
-            
+                break
+
+        self.reduce(operands, operators, -1)
+        if operators:
+            raise ParseError("Expected RP before the end of the expression", self.tokens[self.position][2])
+        return operands[0]
+
+    def parse_kind(self, classes, description):
+        offset = self.tokens[self.position][2]
+        node = self.parse_operators()
+        if not isinstance(node, classes):
+            raise ParseError(f"Expected {description}", offset)
+        return node
+
+    def parse_sum(self):
+        return self.parse_kind(ARITHMETIC_CLASSES, "an expression")
+
+    def parse_equality(self):
+        return self.parse_kind(Equation, "an equation")
+
+    def parse_boolean(self):
+        return self.parse_kind(BOOLEAN_CLASSES, "a comparison")
+
+    # Entry points for single pieces of a problem
+
+    def parse_expression(self, string):
+        self.start(string)
+        expression = self.parse_sum()
+        self.expect("END")
+        return expression
+
+    def parse_equation(self, string, base=0):
+        self.start(string, base)
+        equation = self.parse_equality()
+        self.expect("END")
+        return equation
+
+    def parse_constraint(self, string, base=0):
+        self.start(string, base)
+        constraint = self.parse_boolean()
+        self.expect("END")
+        return constraint
+
     # main parsing function
-    def parse_problem(self, current_string, kw1_found=False, kw2_found=False):
+    def parse_problem(self, string):
+        self.start(string)
+        self.expect("SOLVE")
 
-        if len(current_string) < 1: return ""
+        equations = [self.parse_equality()]
+        while self.accept("COMMA"):
+            equations.append(self.parse_equality())
 
-        # White spaces should always be ignored
-        elif self.ws_p.parse(current_string) != []:
-            rest_string = rest(self.ws_p.parse(current_string))
-            return self.parse_problem(rest_string, kw1_found, kw2_found)
-        
-        # Checks for "Solve"
-        elif self.solve_p.parse(current_string) != []:
-            rest_string = rest(self.solve_p.parse(current_string))
-            return self.parse_problem(rest_string, True, kw2_found)
-        
-        # If kw1 and !kw2, look for equations
-        if (kw1_found and not kw2_found):
-            # Find all equations
-            equation_finder = self.equations_finder(current_string)
-            equations = equation_finder["found_expressions"]
-            rest_string = equation_finder["rest_string"]
-
-            # Parse equations to symbolic classes
-            symbolic_equations = []
-            for equation in equations:
-                symbolic_equations.append(self.parse_equation(equation))
-
-            return {
-                "equations": symbolic_equations,
-                "constraints": self.parse_problem(rest_string, kw1_found, True)
-            }
-
-        # If kw1 and kw2, look for constraints
-        elif (kw1_found and kw2_found):
-            if len(current_string) < 1: return ""
-
-            # Find all constraints
-            equation_finder = self.equations_finder(current_string)
-            constraints = equation_finder["found_expressions"]
-            
-            # Parse constraints to symbolic classes
-            symbolic_constraints = []
-            for constraint in constraints:
-                symbolic_constraints.append(self.parse_constraint(constraint))
-            return symbolic_constraints
+        constraints = []
+        if self.accept("SUCH_THAT"):
+            constraints.append(self.parse_boolean())
+            while self.accept("COMMA"):
+                constraints.append(self.parse_boolean())
+
+        # The final '.' may be missing at the end of the file
+        self.accept("DOT")
+        self.expect("END")
+
+        return {
+            "equations": equations,
+            "constraints": constraints
+        }
+
+    def read_problem(self, chunks):
+        '''
+        Cuts a problem given as a stream of text chunks into statements (see read_statements),
+        yielding "equation" or "constraint" for each of them with the tokens of the statement
+        in self.tokens and self.position at its first token. The caller moves self.position
+        past the equation or constraint before asking for the next one. As in parse_problem,
+        the final '.' may be missing.
+        '''
+        section = None
+        finished = False
+        for text, offset, terminator in read_statements(chunks):
+            self.start(text, offset)
+
+            if finished:
+                # only white space may follow the final '.'
+                self.expect("END")
+                continue
+            if section is None:
+                self.expect("SOLVE")
+                section = "equations"
+
+            if section == "equations":
+                yield "equation"
+                if self.accept("SUCH_THAT"):
+                    section = "constraints"
+            if section == "constraints":
+                yield "constraint"
+            self.expect("END")
+            finished = terminator != ","
+
+    def stream_problem(self, chunks):
+        """
+        Parses a problem given as a stream of text chunks (see read_chunks), yielding
+        ("equation", Equation) and ("constraint", constraint) pairs as soon as the ',' or '.'
+        ending each of them is read. Every statement is parsed with a fresh NodeFactory,
+        so nothing is kept from one statement to the next.
+
+        Example:
+        >>> for kind, node in ParseDiophantine().stream_problem(["Solve x + y", " = 3, x", " = 1 such that y > 0."]):
+        ...     print(kind, node)
+        equation (x + y) = 3
+        equation x = 1
+        constraint (y > 0)
+        """
+        for kind in self.read_problem(chunks):
+            yield kind, self.parse_equality() if kind == "equation" else self.parse_boolean()
+
+    def split_problem(self, string):
+        """
+        Returns the list of (kind, text, offset) of the statements of a problem description
+        without parsing them, kind being "equation" or "constraint" and offset the index
+        of text in the description
+
+        Example:
+        >>> ParseDiophantine().split_problem("Solve x + y = 3, x = 1 such that y > 0")
+        [('equation', 'x + y = 3', 6), ('equation', 'x = 1', 17), ('constraint', 'y > 0', 33)]
+        >>> ParseDiophantine().split_problem("Solve x = 1. y = 2")
+        Traceback (most recent call last):
+        ...
+        parsers.ParseError: Expected END but found 'y' (at offset 13)
+        """
+        statements = []
+        for kind in self.read_problem([string]):
+            start = self.tokens[self.position][2]
+            # neither 'such that' nor the end of the statement can be inside an equation or constraint
+            while self.peek() not in ("SUCH_THAT", "END"):
+                self.position += 1
+            end = self.tokens[self.position][2]
+            statements.append((kind, string[start:end].rstrip(), start))
+        return statements
@@ -0,0 +1,363 @@
+from backend import z3
+from symbolic_classes import postorder, arithmetic_term, SQUARING_DEGREE, Equation, Variable, Constant, Addition, Multiplication, Power, Conjunction, OrUnion, GreaterThan, LessThan
+
+# Sparse polynomial normal form
+#
+# A polynomial is stored as a dictionary {monomial: integer coefficient} where a
+# monomial is a tuple of (variable name, exponent) pairs sorted by name, and the
+# constant monomial is the empty tuple. Products are expanded, constants folded
+# and zero coefficients dropped, so two expressions are equal as polynomials if
+# and only if they have the same terms.
+
+def multiply_monomials(monomial1, monomial2):
+    exponents = dict(monomial1)
+    for name, exponent in monomial2:
+        exponents[name] = exponents.get(name, 0) + exponent
+    return tuple(sorted(exponents.items()))
+
+class Polynomial:
+    def __init__(self, terms=None):
+        self.terms = {monomial: coefficient for monomial, coefficient in (terms or {}).items() if coefficient != 0}
+
+    @staticmethod
+    def from_expression(expression):
+        """
+        Expands an expression of the symbolic classes to a polynomial
+
+        Example:
+        >>> from parsers import ParseDiophantine
+        >>> print(Polynomial.from_expression(ParseDiophantine().parse_expression("(x + 1)*(x - 1) + 2x*x")))
+        3*x^2 - 1
+        >>> print(Polynomial.from_expression(ParseDiophantine().parse_expression("(x + 1)^3 - x^2*x")))
+        3*x^2 + 3*x + 1
+        """
+        polynomials = {}
+        for node in postorder(expression):
+            operands = [polynomials[id(operand)] for operand in node.operands()]
+            if isinstance(node, Variable):
+                polynomial = Polynomial({((node.name, 1),): 1})
+            elif isinstance(node, Constant):
+                polynomial = Polynomial({(): node.value})
+            elif isinstance(node, Addition):
+                # the terms of all the operands are added in place
+                terms = {}
+                for operand in operands:
+                    for monomial, coefficient in operand.terms.items():
+                        terms[monomial] = terms.get(monomial, 0) + coefficient
+                polynomial = Polynomial(terms)
+            elif isinstance(node, Multiplication):
+                polynomial = operands[0]
+                for operand in operands[1:]:
+                    polynomial = polynomial * operand
+            elif isinstance(node, Power):
+                polynomial = operands[0] ** node.exponent
+            else:
+                raise TypeError(f"Cannot convert {type(node).__name__} to a polynomial")
+            polynomials[id(node)] = polynomial
+        return polynomials[id(expression)]
+
+    @staticmethod
+    def from_relation(relation):
+        '''
+        Moves everything to the left side of an Equation, GreaterThan or LessThan: returns left - right
+        '''
+        return Polynomial.from_expression(relation.left_expression) - Polynomial.from_expression(relation.right_expression)
+
+    def __add__(self, other):
+        terms = dict(self.terms)
+        for monomial, coefficient in other.terms.items():
+            terms[monomial] = terms.get(monomial, 0) + coefficient
+        return Polynomial(terms)
+
+    def __neg__(self):
+        return Polynomial({monomial: -coefficient for monomial, coefficient in self.terms.items()})
+
+    def __sub__(self, other):
+        return self + (-other)
+
+    def __mul__(self, other):
+        terms = {}
+        for monomial1, coefficient1 in self.terms.items():
+            for monomial2, coefficient2 in other.terms.items():
+                monomial = multiply_monomials(monomial1, monomial2)
+                terms[monomial] = terms.get(monomial, 0) + coefficient1 * coefficient2
+        return Polynomial(terms)
+
+    def __pow__(self, exponent):
+        # square and multiply
+        result = Polynomial({(): 1})
+        square = self
+        while exponent > 0:
+            if exponent % 2 == 1:
+                result = result * square
+            exponent //= 2
+            if exponent > 0:
+                square = square * square
+        return result
+
+    def __eq__(self, other):
+        return isinstance(other, Polynomial) and self.terms == other.terms
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def key(self):
+        '''
+        Hashable canonical form of the polynomial
+        '''
+        return tuple(sorted(self.terms.items()))
+
+    def leading_coefficient(self):
+        terms = self.sorted_terms()
+        return terms[0][1] if terms else 0
+
+    def constant(self):
+        return self.terms.get((), 0)
+
+    def degree(self):
+        return max((sum(exponent for name, exponent in monomial) for monomial in self.terms), default=0)
+
+    def is_linear(self):
+        return self.degree() <= 1
+
+    def variables(self):
+        return {name for monomial in self.terms for name, exponent in monomial}
+
+    def evaluate(self, values):
+        '''
+        Value of the polynomial for the dictionary of values of its variables
+        '''
+        total = 0
+        for monomial, coefficient in self.terms.items():
+            term = coefficient
+            for name, exponent in monomial:
+                term *= values[name] ** exponent
+            total += term
+        return total
+
+    def sorted_terms(self):
+        # highest degree first, then alphabetically
+        return sorted(self.terms.items(), key=lambda term: (-sum(exponent for name, exponent in term[0]), term[0]))
+
+    def __str__(self):
+        text = ""
+        for monomial, coefficient in self.sorted_terms():
+            factors = [name if exponent == 1 else f"{name}^{exponent}" for name, exponent in monomial]
+            if monomial == ():
+                factors = [str(abs(coefficient))]
+            elif abs(coefficient) != 1:
+                factors = [str(abs(coefficient))] + factors
+            sign = "-" if coefficient < 0 else "+"
+            if text == "":
+                text = ("-" if coefficient < 0 else "") + "*".join(factors)
+            else:
+                text += f" {sign} " + "*".join(factors)
+        return text if text != "" else "0"
+
+    def __repr__(self):
+        return f"Polynomial({self})"
+
+    def toz3(self, monomial_terms=None, definitions=None):
+        '''
+        Returns the z3 term of the non-constant part of the polynomial, or None if there is none.
+        Monomials found in monomial_terms are replaced by the given term. If a list of definitions
+        is given, powers of degree SQUARING_DEGREE or more are replaced by auxiliary variables
+        (see define_power)
+        '''
+        terms = []
+        for monomial, coefficient in self.sorted_terms():
+            if monomial == ():
+                continue
+            if monomial_terms is not None and monomial in monomial_terms:
+                term = monomial_terms[monomial]
+            else:
+                term = monomial_toz3(monomial, monomial_terms, definitions)
+            terms.append(term if coefficient == 1 else arithmetic_term(z3.Z3_mk_mul, [z3.IntVal(coefficient), term]))
+        if terms == []:
+            return None
+        return terms[0] if len(terms) == 1 else arithmetic_term(z3.Z3_mk_add, terms)
+
+def monomial_toz3(monomial, monomial_terms=None, definitions=None):
+    # powers of a single variable found in monomial_terms are replaced by the given term, and
+    # high powers by auxiliary variables if there is a list of definitions to add theirs to
+    factors = []
+    for name, exponent in monomial:
+        power = ((name, exponent),)
+        if monomial_terms is not None and power in monomial_terms:
+            factors.append(monomial_terms[power])
+        elif definitions is not None and exponent >= SQUARING_DEGREE:
+            factors.append(define_power(name, exponent, monomial_terms, definitions))
+        else:
+            factors.extend([z3.Int(name)] * exponent)
+    return factors[0] if len(factors) == 1 else arithmetic_term(z3.Z3_mk_mul, factors)
+
+def define_power(name, exponent, monomial_terms, definitions):
+    """
+    Returns the auxiliary variable standing for the power name^exponent, introducing it unless
+    it is in monomial_terms. Powers are defined from the powers of half their degree (x^9 = x^4 * x^5,
+    x^4 = x^2 * x^2...), which get auxiliary variables too, so x^k takes about log2(k) definitions.
+    New auxiliary variables are added to monomial_terms (as the monomials ((name, exponent),))
+    and their definitions, auxiliary = product, to definitions.
+
+    Example:
+    >>> definitions = []
+    >>> define_power("x", 9, {}, definitions), definitions
+    (!x^9, [!x^2 == x*x, !x^3 == x*!x^2, !x^4 == !x^2*!x^2, !x^5 == !x^2*!x^3, !x^9 == !x^4*!x^5])
+    """
+    exponents = set()
+    stack = [exponent]
+    while stack:
+        current = stack.pop()
+        if current > 1 and current not in exponents and ((name, current),) not in monomial_terms:
+            exponents.add(current)
+            stack.extend((current // 2, current - current // 2))
+    for current in sorted(exponents):
+        half = current // 2
+        factors = [monomial_toz3(((name, part),), monomial_terms) for part in (half, current - half)]
+        auxiliary = z3.Int(AUXILIARY_PREFIX + monomial_name(((name, current),)))
+        monomial_terms[((name, current),)] = auxiliary
+        definitions.append(auxiliary == arithmetic_term(z3.Z3_mk_mul, factors))
+    return monomial_terms[((name, exponent),)]
+
+# Auxiliary variables standing for shared monomials start with this prefix, which
+# cannot appear in the name of a variable of a problem
+AUXILIARY_PREFIX = "!"
+
+def monomial_name(monomial):
+    return "*".join(name if exponent == 1 else f"{name}^{exponent}" for name, exponent in monomial)
+
+def boolean_operands(node):
+    # operands of the boolean structure of a constraint, the relations are its leaves
+    return node.operands() if isinstance(node, (Conjunction, OrUnion)) else ()
+
+def is_relation(node):
+    return isinstance(node, (Equation, GreaterThan, LessThan))
+
+def relation_polynomials(node):
+    '''
+    Returns the polynomials of all the relations (Equation, GreaterThan, LessThan) inside a node
+    '''
+    return [Polynomial.from_relation(relation) for relation in postorder(node, boolean_operands) if is_relation(relation)]
+
+def shared_monomials(nodes):
+    """
+    Introduces an auxiliary variable for every nonlinear monomial occurring in more than one
+    relation of the nodes, and for every power x^k of a variable occurring in more than one
+    monomial or of degree SQUARING_DEGREE or more (see define_power). Monomials are built from
+    the auxiliary variables of their powers. Returns
+    ({monomial: auxiliary z3 variable}, [definitions]) where the definitions are the z3
+    equations auxiliary = product, to be added with the problem; powers x^k are the
+    monomials ((x, k),).
+
+    Examples:
+    >>> from parsers import ParseDiophantine
+    >>> parser = ParseDiophantine()
+    >>> nodes = [parser.parse_equation("x*x + y = 3"), parser.parse_constraint("x*x > y or x*y < 0")]
+    >>> shared_monomials(nodes)[1]
+    [!x^2 == x*x]
+    >>> shared_monomials([parser.parse_equation("x^9 + x^2*y = 1")])[1]
+    [!x^2 == x*x, !x^3 == x*!x^2, !x^4 == !x^2*!x^2, !x^5 == !x^2*!x^3, !x^9 == !x^4*!x^5]
+    """
+    counts = {}
+    power_counts = {}
+    for node in nodes:
+        for polynomial in relation_polynomials(node):
+            for monomial in polynomial.terms:
+                if sum(exponent for name, exponent in monomial) > 1:
+                    counts[monomial] = counts.get(monomial, 0) + 1
+                for name, exponent in monomial:
+                    if exponent > 1:
+                        power_counts[(name, exponent)] = power_counts.get((name, exponent), 0) + 1
+
+    monomial_terms = {}
+    definitions = []
+    for name, exponent in sorted(power for power, count in power_counts.items() if count > 1 or power[1] >= SQUARING_DEGREE):
+        define_power(name, exponent, monomial_terms, definitions)
+    for monomial in sorted(monomial for monomial, count in counts.items() if count > 1):
+        if monomial in monomial_terms:
+            continue
+        auxiliary = z3.Int(AUXILIARY_PREFIX + monomial_name(monomial))
+        definitions.append(auxiliary == monomial_toz3(monomial, monomial_terms))
+        monomial_terms[monomial] = auxiliary
+    return monomial_terms, definitions
+
+def canonical_toz3(node, monomial_terms=None, definitions=None):
+    """
+    Lowers an Equation or constraint to z3 through the polynomial normal form: every relation
+    becomes (non-constant terms) = / > / < (constant), with products expanded and constants folded.
+    Equations are scaled by -1 if needed so that their leading coefficient is positive.
+    Monomials found in monomial_terms (see shared_monomials) are replaced by the given term.
+    If a list of definitions is given, powers of degree SQUARING_DEGREE or more are replaced by
+    auxiliary variables defined by repeated squaring (see define_power), which are added to
+    monomial_terms (it must then be a dictionary) and their definitions to definitions.
+
+    Examples:
+    >>> from parsers import ParseDiophantine
+    >>> parser = ParseDiophantine()
+    >>> canonical_toz3(parser.parse_equation("x*x - z + 2 = u + (x + 1)*(x - 1)"))
+    u + z == 3
+    >>> definitions = []
+    >>> canonical_toz3(parser.parse_equation("x^4*y + x^2 = 1"), {}, definitions), definitions
+    (!x^4*y + !x^2 == 1, [!x^2 == x*x, !x^4 == !x^2*!x^2])
+    """
+    terms = {}
+    for current in postorder(node, boolean_operands):
+        operands = [terms[id(operand)] for operand in boolean_operands(current)]
+        if isinstance(current, Conjunction):
+            terms[id(current)] = z3.And(operands)
+        elif isinstance(current, OrUnion):
+            terms[id(current)] = z3.Or(operands)
+        else:
+            terms[id(current)] = relation_toz3(current, monomial_terms, definitions)
+    return terms[id(node)]
+
+def relation_toz3(node, monomial_terms=None, definitions=None):
+    polynomial = Polynomial.from_relation(node)
+    if isinstance(node, Equation) and polynomial.leading_coefficient() < 0:
+        polynomial = -polynomial
+    left = polynomial.toz3(monomial_terms, definitions)
+    right = -polynomial.constant()
+    if isinstance(node, Equation):
+        return left == right if left is not None else z3.BoolVal(0 == right)
+    if isinstance(node, GreaterThan):
+        return left > right if left is not None else z3.BoolVal(0 > right)
+    if isinstance(node, LessThan):
+        return left < right if left is not None else z3.BoolVal(0 < right)
+    raise TypeError(f"Cannot lower {type(node).__name__} to z3")
+
+def canonical_key(node):
+    """
+    Returns a hashable key of an Equation or constraint, equal for relations with the same
+    polynomial normal form, e.g. x + y = 2 and 2 - y = x. Conjunctions and unions ignore the
+    order of their operands.
+
+    Example:
+    >>> from parsers import ParseDiophantine
+    >>> parser = ParseDiophantine()
+    >>> canonical_key(parser.parse_equation("x + y = 2")) == canonical_key(parser.parse_equation("2 - y = x"))
+    True
+    >>> canonical_key(parser.parse_constraint("x > 1 or y < 0")) == canonical_key(parser.parse_constraint("0 > y or 1 < x"))
+    True
+    """
+    keys = {}
+    for current in postorder(node, boolean_operands):
+        operands = frozenset(keys[id(operand)] for operand in boolean_operands(current))
+        if isinstance(current, Conjunction):
+            keys[id(current)] = ("and", operands)
+        elif isinstance(current, OrUnion):
+            keys[id(current)] = ("or", operands)
+        else:
+            keys[id(current)] = relation_key(current)
+    return keys[id(node)]
+
+def relation_key(node):
+    polynomial = Polynomial.from_relation(node)
+    if isinstance(node, Equation):
+        if polynomial.leading_coefficient() < 0:
+            polynomial = -polynomial
+        return ("=", polynomial.key())
+    if isinstance(node, GreaterThan):
+        return (">", polynomial.key())
+    if isinstance(node, LessThan):
+        return (">", (-polynomial).key())
+    raise TypeError(f"Cannot build a key for {type(node).__name__}")
@@ -0,0 +1,127 @@
+import multiprocessing
+import time
+from multiprocessing.connection import wait
+
+from backend import z3
+from parsers import ParseDiophantine
+from solve import lower_problem, model_to_dict
+
+# Portfolio solving
+#
+# The same problem is solved by several differently configured z3 solvers, each in
+# its own process, and the first definitive answer ("sat" or "unsat") wins: the other
+# processes are killed right away. Configurations are dictionaries with a "name" and
+# optionally a chain of z3 "tactics", solver "parameters" (e.g. a random seed) and a
+# "bit_width" to bit-blast the problem with variables of at most that many bits (only
+# its "sat" answers are definitive, an "unsat" there only means no small solution).
+
+CONFIGURATIONS = [
+    {"name": "default"},
+    {"name": "qfnia", "tactics": ["qfnia"]},
+    {"name": "nlsat", "tactics": ["simplify", "purify-arith", "tseitin-cnf", "nlsat"]},
+    {"name": "seed-1", "parameters": {"random_seed": 1, "smt.arith.random_initial_value": True}},
+    {"name": "bit-blast-16", "bit_width": 16},
+]
+TIMEOUT = 60.0
+
+def make_solver(configuration):
+    '''
+    Builds the z3 solver described by a configuration
+    '''
+    if "bit_width" in configuration:
+        tactic = z3.Then("simplify", z3.With("nla2bv", nla2bv_max_bv_size=configuration["bit_width"]), "simplify", "bit-blast", "sat")
+        solver = tactic.solver()
+    elif "tactics" in configuration:
+        tactics = configuration["tactics"]
+        solver = (z3.Tactic(tactics[0]) if len(tactics) == 1 else z3.Then(*tactics)).solver()
+    else:
+        solver = z3.Solver()
+    for name, value in configuration.get("parameters", {}).items():
+        solver.set(name, value)
+    return solver
+
+def run_configuration(description, configuration, timeout, connection):
+    '''
+    Solves a problem with one configuration in a worker process and sends back (status, model)
+    '''
+    try:
+        solver = make_solver(configuration)
+        solver.set("timeout", int(timeout * 1000))
+        solver.add(lower_problem(ParseDiophantine().parse_problem(description)))
+        status = str(solver.check())
+        model = model_to_dict(solver.model()) if status == "sat" else None
+        if status == "unsat" and "bit_width" in configuration:
+            status = "unknown"
+        connection.send((status, model))
+    except Exception as error:
+        connection.send(("error", f"{type(error).__name__}: {error}"))
+    finally:
+        connection.close()
+
+def solve_portfolio(description, configurations=CONFIGURATIONS, timeout=TIMEOUT):
+    """
+    Solves a problem with every configuration in parallel, one process each, and returns the
+    first definitive result. The other processes are killed as soon as it arrives. If no
+    configuration answers within timeout seconds, or none of them gives a definitive answer,
+    the status is "unknown". The result also tells which configuration won ("configuration")
+    and the status of every configuration ("configurations"), "cancelled" for the killed ones.
+
+    Examples:
+    >>> result = solve_portfolio(open("examples/example4.txt").read())
+    >>> result["engine"], result["status"], result["model"]
+    ('portfolio', 'unsat', None)
+    >>> result = solve_portfolio("Solve x*x*x + y*y*y + z*z*z = 33.", timeout=1)
+    >>> result["status"], result["configuration"]
+    ('unknown', None)
+    """
+    start = time.perf_counter()
+    # syntax errors are raised here rather than in every worker
+    ParseDiophantine().parse_problem(description)
+    timings = {"parse": time.perf_counter() - start}
+
+    start = time.perf_counter()
+    deadline = start + timeout
+    workers = {}
+    for configuration in configurations:
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=run_configuration, args=(description, configuration, timeout, sender), daemon=True)
+        process.start()
+        sender.close()
+        workers[receiver] = (configuration["name"], process)
+
+    statuses = {name: "cancelled" for name, process in workers.values()}
+    winner = None
+    status, model = "unknown", None
+    pending = list(workers)
+    try:
+        while pending and winner is None:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            for receiver in wait(pending, remaining):
+                pending.remove(receiver)
+                name = workers[receiver][0]
+                try:
+                    answer, answer_model = receiver.recv()
+                except EOFError:
+                    answer, answer_model = "error", None
+                statuses[name] = answer
+                if answer in ("sat", "unsat"):
+                    winner, status, model = name, answer, answer_model
+                    break
+    finally:
+        for receiver, (name, process) in workers.items():
+            if process.is_alive():
+                process.kill()
+            process.join()
+            receiver.close()
+    timings["portfolio"] = time.perf_counter() - start
+
+    return {
+        "status": status,
+        "model": model,
+        "engine": "portfolio",
+        "configuration": winner,
+        "configurations": statuses,
+        "timings": timings
+    }
@@ -0,0 +1,201 @@
+from collections import deque
+
+from symbolic_classes import postorder, NodeFactory, Equation, Variable, Constant, Addition, Multiplication, Conjunction, OrUnion, GreaterThan
+from polynomial import Polynomial, boolean_operands
+
+# Presolve
+#
+# Before searching, variables defined by a linear equation with a unit coefficient
+# (x - z = 5 defines x = z + 5) are substituted out of the rest of the problem, one
+# after the other until no equation defines a variable. Relations are handled in
+# polynomial normal form, so constants are folded on the way; equations that become
+# 0 = 0 are dropped, equations like 0 = 3 make the problem unsatisfiable and
+# constraints are simplified when some of their comparisons become constant. The
+# values of the eliminated variables are recovered from a model of what is left.
+
+def substitute(polynomial, name, replacement):
+    '''
+    Returns the polynomial with every occurrence of the variable name replaced by the replacement polynomial
+    '''
+    terms = {}
+    for monomial, coefficient in polynomial.terms.items():
+        exponent = dict(monomial).get(name, 0)
+        if exponent == 0:
+            terms[monomial] = terms.get(monomial, 0) + coefficient
+            continue
+        term = Polynomial({tuple((other, power) for other, power in monomial if other != name): coefficient})
+        for _ in range(exponent):
+            term = term * replacement
+        for term_monomial, term_coefficient in term.terms.items():
+            terms[term_monomial] = terms.get(term_monomial, 0) + term_coefficient
+    return Polynomial(terms)
+
+def pivot(polynomial):
+    '''
+    Returns a variable which the polynomial (meaning polynomial = 0) defines, or None: a variable
+    occurring only in a term of degree 1 with coefficient 1 or -1, the first one by name if there are several
+    '''
+    occurrences = {}
+    for monomial in polynomial.terms:
+        for name, exponent in monomial:
+            occurrences[name] = occurrences.get(name, 0) + 1
+    candidates = [name for name, count in occurrences.items()
+                  if count == 1 and polynomial.terms.get(((name, 1),)) in (1, -1)]
+    return min(candidates, default=None)
+
+def polynomial_expression(polynomial, factory):
+    '''
+    Builds the expression of the symbolic classes of a polynomial
+    '''
+    terms = []
+    for monomial, coefficient in polynomial.sorted_terms():
+        factors = [factory.power(factory.make(Variable, name), exponent) for name, exponent in monomial]
+        if coefficient != 1 or factors == []:
+            factors.insert(0, factory.make(Constant, coefficient))
+        term = factors[-1]
+        for factor in reversed(factors[:-1]):
+            term = factory.make(Multiplication, factor, term)
+        terms.append(term)
+    if terms == []:
+        return factory.make(Constant, 0)
+    expression = terms[-1]
+    for term in reversed(terms[:-1]):
+        expression = factory.make(Addition, term, expression)
+    return expression
+
+def relation_node(cls, polynomial, factory):
+    '''
+    Builds the relation (non-constant terms) cls (constant) of polynomial cls 0
+    '''
+    constant = polynomial.constant()
+    left = polynomial_expression(polynomial - Polynomial({(): constant}), factory)
+    return factory.make(cls, left, factory.make(Constant, -constant))
+
+def constant_truth(cls, value):
+    if cls is Equation:
+        return value == 0
+    if cls is GreaterThan:
+        return value > 0
+    return value < 0
+
+def combine(cls, operands, factory):
+    '''
+    Folds a conjunction or union of operands which are True, False or nodes
+    '''
+    # True decides a union and False a conjunction, the other one can be left out
+    absorbing = cls is OrUnion
+    neutral = not absorbing
+    if any(operand is absorbing for operand in operands):
+        return absorbing
+    operands = [operand for operand in operands if operand is not neutral]
+    if operands == []:
+        return neutral
+    node = operands[-1]
+    for operand in reversed(operands[:-1]):
+        node = factory.make(cls, operand, node)
+    return node
+
+def simplify_constraint(node, substitutions, factory):
+    '''
+    Applies the substitutions to a constraint, returns True, False or the simplified node
+    '''
+    eliminated = {name for name, replacement in substitutions}
+    values = {}
+    for current in postorder(node, boolean_operands):
+        if isinstance(current, (Conjunction, OrUnion)):
+            operands = [values[id(operand)] for operand in current.operands()]
+            if all(value is operand for value, operand in zip(operands, current.operands())):
+                values[id(current)] = current
+            else:
+                values[id(current)] = combine(type(current), operands, factory)
+            continue
+
+        polynomial = Polynomial.from_relation(current)
+        changed = not eliminated.isdisjoint(polynomial.variables())
+        for name, replacement in substitutions:
+            if name in polynomial.variables():
+                polynomial = substitute(polynomial, name, replacement)
+        if polynomial.degree() == 0:
+            values[id(current)] = constant_truth(type(current), polynomial.constant())
+        else:
+            values[id(current)] = relation_node(type(current), polynomial, factory) if changed else current
+    return values[id(node)]
+
+def presolve_problem(parsed):
+    """
+    Eliminates the variables defined by linear equations with a unit coefficient (substituting
+    nonlinear definitions would raise the degree of the other relations). Returns a dictionary
+    with the "status" ("unsat" if an equation or constraint became false, "sat" if nothing is left to
+    solve, None otherwise), the "parsed" problem left, and the "substitutions" [(name, Polynomial)] in
+    order of elimination.
+
+    Example:
+    >>> from parsers import ParseDiophantine
+    >>> presolved = presolve_problem(ParseDiophantine().parse_problem("Solve x - z = 5, x*y = u*u, u + y = 1 such that x > 2 or u < y."))
+    >>> [(name, str(replacement)) for name, replacement in presolved["substitutions"]]
+    [('x', 'z + 5'), ('u', '-y + 1')]
+    >>> [str(node) for node in presolved["parsed"]["equations"] + presolved["parsed"]["constraints"]]
+    ['((y * z) + ((-1 * (y ^ 2)) + (7 * y))) = 1', '((z > -3) or ((-2 * y) < -1))']
+    >>> presolve_problem(ParseDiophantine().parse_problem("Solve x - z = 5, x = z."))["status"]
+    'unsat'
+    """
+    factory = NodeFactory()
+    queue = deque([node, Polynomial.from_relation(node), False] for node in parsed["equations"])
+    kept = []
+    substitutions = []
+
+    while queue:
+        item = queue.popleft()
+        node, polynomial, changed = item
+        if polynomial.terms == {}:
+            continue
+        if polynomial.degree() == 0:
+            return {"status": "unsat", "parsed": None, "substitutions": substitutions}
+        name = pivot(polynomial) if polynomial.is_linear() else None
+        if name is None:
+            kept.append(item)
+            continue
+
+        coefficient = polynomial.terms[((name, 1),)]
+        rest = polynomial - Polynomial({((name, 1),): coefficient})
+        replacement = -rest if coefficient == 1 else rest
+        substitutions.append((name, replacement))
+
+        for other in list(queue) + kept:
+            if name in other[1].variables():
+                other[1] = substitute(other[1], name, replacement)
+                other[2] = True
+        # equations changed by the substitution may define a variable now
+        queue.extend(other for other in kept if other[2])
+        kept = [other for other in kept if not other[2]]
+
+    equations = [relation_node(Equation, polynomial, factory) if changed else node for node, polynomial, changed in kept]
+    constraints = []
+    for constraint in parsed["constraints"]:
+        simplified = simplify_constraint(constraint, substitutions, factory)
+        if simplified is False:
+            return {"status": "unsat", "parsed": None, "substitutions": substitutions}
+        if simplified is not True:
+            constraints.append(simplified)
+
+    status = "sat" if equations == [] and constraints == [] else None
+    return {"status": status, "parsed": {"equations": equations, "constraints": constraints}, "substitutions": substitutions}
+
+def recover_model(model, substitutions, names):
+    """
+    Completes a model of the presolved problem with the values of the eliminated variables,
+    giving 0 to the variables of names left without a value (they can take any value).
+
+    Example:
+    >>> substitutions = [("x", Polynomial({(("z", 1),): 1, (): 5})), ("u", Polynomial({(("z", 1),): -2, (("v", 1),): 1}))]
+    >>> recover_model({"z": 1}, substitutions, ["u", "v", "x", "z"])
+    {'z': 1, 'u': -2, 'v': 0, 'x': 6}
+    """
+    values = dict(model)
+    for name, replacement in reversed(substitutions):
+        for other in replacement.variables():
+            values.setdefault(other, 0)
+        values[name] = replacement.evaluate(values)
+    for name in names:
+        values.setdefault(name, 0)
+    return {name: values[name] for name in list(model) + [name for name in names if name not in model]}
@@ -0,0 +1,108 @@
+import time
+from contextlib import contextmanager
+
+from symbolic_classes import postorder
+
+# Instrumentation of the solve pipeline
+#
+# Every phase of solving is timed with phase(), which always records the wall time
+# in the timings of the result. When a Profiler is given it also measures the CPU
+# time and collects the number of AST nodes, the number of z3 terms and the
+# statistics of the z3 solver, and passes everything to its hooks as it comes.
+# Without a Profiler nothing besides the wall time is measured.
+
+class Profiler:
+    """
+    Collects the wall and CPU time of the phases, counters and solver statistics of a run.
+    Hooks are called as hook(kind, name, value) for every measure, with kind "phase",
+    "count" or "statistics", e.g. to export metrics.
+
+    Example:
+    >>> from solve import solve_problem
+    >>> events = []
+    >>> profiler = Profiler(hooks=[lambda kind, name, value: events.append((kind, name))])
+    >>> result = solve_problem("Solve x*y + z = 3 such that x > 1.", profiler=profiler)
+    >>> sorted(profiler.phases), profiler.counts["ast_nodes"], "statistics" in result["profile"]
+    (['backend', 'bounded', 'classify', 'linear', 'parse', 'presolve', 'refute', 'solve', 'toz3'], 9, True)
+    >>> events[:3]
+    [('phase', 'parse'), ('count', 'ast_nodes'), ('phase', 'classify')]
+    """
+    def __init__(self, hooks=None):
+        self.hooks = list(hooks or [])
+        self.phases = {}
+        self.counts = {}
+        self.statistics = {}
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def emit(self, kind, name, value):
+        for hook in self.hooks:
+            hook(kind, name, value)
+
+    def record_phase(self, name, wall, cpu):
+        times = self.phases.setdefault(name, {"wall": 0.0, "cpu": 0.0})
+        times["wall"] += wall
+        times["cpu"] += cpu
+        self.emit("phase", name, {"wall": wall, "cpu": cpu})
+
+    def count(self, name, value):
+        self.counts[name] = self.counts.get(name, 0) + value
+        self.emit("count", name, value)
+
+    def record_statistics(self, solver):
+        statistics = solver.statistics()
+        for key in statistics.keys():
+            self.statistics[key] = statistics.get_key_value(key)
+        self.emit("statistics", "solver", dict(self.statistics))
+
+    def report(self):
+        return {"phases": self.phases, "counts": self.counts, "statistics": self.statistics}
+
+    def format(self):
+        '''
+        Text report with one line per phase, counter and statistic
+        '''
+        lines = [f"{'phase':24} {'wall ms':>10} {'cpu ms':>10}"]
+        for name, times in self.phases.items():
+            lines.append(f"{name:24} {times['wall'] * 1000:10.3f} {times['cpu'] * 1000:10.3f}")
+        for name, value in self.counts.items():
+            lines.append(f"{name:24} {value:>10}")
+        for name, value in sorted(self.statistics.items()):
+            lines.append(f"{name:24} {value:>10}")
+        return "\n".join(lines)
+
+@contextmanager
+def phase(timings, name, profiler=None):
+    '''
+    Adds the wall time of the block to timings[name], and reports it with the CPU time to the profiler if any
+    '''
+    start = time.perf_counter()
+    cpu_start = time.process_time() if profiler is not None else 0.0
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - start
+        timings[name] = timings.get(name, 0.0) + wall
+        if profiler is not None:
+            profiler.record_phase(name, wall, time.process_time() - cpu_start)
+
+def count_nodes(nodes):
+    '''
+    Number of distinct nodes of the symbolic classes reachable from the nodes
+    '''
+    return sum(1 for node in postorder(list(nodes), lambda node: node.children()))
+
+def count_terms(terms):
+    '''
+    Number of distinct z3 terms reachable from the terms
+    '''
+    seen = set()
+    stack = list(terms)
+    while stack:
+        term = stack.pop()
+        if term.get_id() in seen:
+            continue
+        seen.add(term.get_id())
+        stack.extend(term.children())
+    return len(seen)
@@ -0,0 +1,106 @@
+from itertools import product
+from math import gcd
+
+from polynomial import Polynomial
+from bounded_search import infer_bounds
+
+# Refutation of unsatisfiable problems
+#
+# Cheap necessary conditions for a solution, checked before any search. A linear
+# equation a1*x1 + ... + an*xn = c has no integer solution unless gcd(a1, ..., an)
+# divides c. Any equation p = 0 has none if p is not 0 modulo some m for any
+# residues of its variables, which is checked exhaustively for small primes and
+# prime powers m when there are few residues to try (x*x - 3*y*y = 2 has no solution
+# modulo 3, x*x + y*y = 4*z + 3 none modulo 4). And
+# interval propagation through the relations (see bounded_search.infer_bounds)
+# proves some problems have no solution. The check that succeeds is reported as a
+# certificate of unsatisfiability.
+
+MODULI = (2, 3, 4, 5, 7, 8, 9)
+MAX_RESIDUES = 4096
+
+def gcd_certificate(polynomial):
+    '''
+    Returns the divisor proving that the linear polynomial = 0 has no integer solution, or None
+    '''
+    if not polynomial.is_linear():
+        return None
+    divisor = 0
+    for monomial, coefficient in polynomial.terms.items():
+        if monomial != ():
+            divisor = gcd(divisor, coefficient)
+    if divisor > 1 and polynomial.constant() % divisor != 0:
+        return divisor
+    return None
+
+def has_root_modulo(polynomial, modulus):
+    '''
+    Whether the polynomial is 0 modulo the modulus for some residues of its variables
+    '''
+    names = sorted(polynomial.variables())
+    terms = []
+    for monomial, coefficient in polynomial.terms.items():
+        if coefficient % modulus != 0:
+            terms.append((coefficient % modulus, [(names.index(name), exponent) for name, exponent in monomial]))
+    for residues in product(range(modulus), repeat=len(names)):
+        total = 0
+        for coefficient, factors in terms:
+            for index, exponent in factors:
+                coefficient = coefficient * pow(residues[index], exponent, modulus) % modulus
+            total += coefficient
+        if total % modulus == 0:
+            return True
+    return False
+
+def modular_certificate(polynomial, moduli=MODULI, max_residues=MAX_RESIDUES):
+    '''
+    Returns a modulus modulo which the polynomial is never 0, or None. Moduli with more than
+    max_residues residues of the variables to try are skipped
+    '''
+    for modulus in moduli:
+        if modulus ** len(polynomial.variables()) > max_residues:
+            continue
+        if not has_root_modulo(polynomial, modulus):
+            return modulus
+    return None
+
+def refute_problem(parsed, moduli=MODULI, max_residues=MAX_RESIDUES):
+    """
+    Looks for a cheap proof that a parsed problem has no solution. Returns a dictionary with the
+    "status" ("unsat" if a proof was found, None otherwise), the "certificate" of the proof and
+    the "bounds" inferred for the variables (None if they prove unsatisfiability). Certificates
+    are {"kind": "gcd", "relation", "divisor"}, {"kind": "modulus", "relation", "modulus"} or
+    {"kind": "bounds"}.
+
+    Examples:
+    >>> from parsers import ParseDiophantine
+    >>> parser = ParseDiophantine()
+    >>> refute_problem(parser.parse_problem("Solve 6*x + 4*y - 2*z = 3."))["certificate"]
+    {'kind': 'gcd', 'relation': '((6 * x) + ((4 * y) + (-2 * z))) = 3', 'divisor': 2}
+    >>> refute_problem(parser.parse_problem("Solve x*x - 3*y*y = 2 such that x*y > 3."))["certificate"]
+    {'kind': 'modulus', 'relation': '((x ^ 2) + (-3 * (y ^ 2))) = 2', 'modulus': 3}
+    >>> refute_problem(parser.parse_problem("Solve x*x + y*y = 4*z + 3."))["certificate"]["modulus"]
+    4
+    >>> refute_problem(parser.parse_problem("Solve x + y = 1 such that x > 0, y > 0."))["certificate"]
+    {'kind': 'bounds'}
+    >>> result = refute_problem(parser.parse_problem("Solve x*x + y*y = 25 such that x > 0, x < 9."))
+    >>> result["status"], result["bounds"]
+    (None, {'x': (1, 8), 'y': (None, None)})
+    """
+    polynomials = [(node, Polynomial.from_relation(node)) for node in parsed["equations"]]
+    for node, polynomial in polynomials:
+        divisor = gcd_certificate(polynomial)
+        if divisor is not None:
+            return {"status": "unsat", "certificate": {"kind": "gcd", "relation": str(node), "divisor": divisor}, "bounds": None}
+    for node, polynomial in polynomials:
+        # a linear equation passing the gcd test has a root modulo every m
+        if polynomial.is_linear():
+            continue
+        modulus = modular_certificate(polynomial, moduli, max_residues)
+        if modulus is not None:
+            return {"status": "unsat", "certificate": {"kind": "modulus", "relation": str(node), "modulus": modulus}, "bounds": None}
+
+    bounds = infer_bounds(parsed)
+    if bounds is None:
+        return {"status": "unsat", "certificate": {"kind": "bounds"}, "bounds": None}
+    return {"status": None, "certificate": None, "bounds": bounds}
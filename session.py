@@ -0,0 +1,169 @@
+from backend import z3
+from parsers import ParseDiophantine
+from polynomial import canonical_toz3, AUXILIARY_PREFIX
+from profiling import phase
+
+# Incremental solving sessions
+#
+# A session keeps one z3 solver alive while a problem is edited a statement at a
+# time. Every statement is parsed and lowered once, the first time its text is seen
+# (texts are compared with runs of white space collapsed), and asserted guarded by a
+# literal of its own: literal implies statement. Solving passes the literals of the
+# statements currently in the problem as assumptions, so retracting a statement
+# only leaves its literal out and adding it back costs nothing, and z3 keeps what it
+# has learnt from one check to the next. push() and pop() save and restore the set
+# of statements in the problem. z3 answers checks with assumptions with its
+# incremental core, which is much weaker on nonlinear problems than the tactics it
+# uses for a one-shot check: when the incremental check has no answer within
+# INCREMENTAL_TIMEOUT seconds, the statements of the problem are checked again by a
+# one-shot solver, still from the terms lowered once.
+
+INCREMENTAL_TIMEOUT = 0.5
+
+def normalize(text):
+    return " ".join(text.split())
+
+class Session:
+    """
+    A problem edited a statement at a time, see add, retract, push, pop and update. Statements
+    are referred to by the key returned by add, (kind, normalized text). solve() returns the
+    result dictionary of the current problem with the timings of the parsing and lowering
+    done since the previous solve, the "core" of the keys of statements which contradict
+    each other if the incremental check found the problem unsatisfiable, whether the answer
+    came from the "incremental" check and the "counts" of statements parsed and lowered so
+    far in the session. z3 gives up after timeout seconds if a timeout is given.
+
+    Example:
+    >>> session = Session()
+    >>> session.update("Solve x + y = 10, x - y = 4 such that x > 0.")
+    >>> result = session.solve()
+    >>> result["status"], result["model"]
+    ('sat', {'x': 7, 'y': 3})
+    >>> session.push()
+    >>> key = session.add_constraint("y > 3")
+    >>> result = session.solve()
+    >>> result["status"], sorted(text for kind, text in result["core"])
+    ('unsat', ['x + y = 10', 'x - y = 4', 'y > 3'])
+    >>> session.pop()
+    >>> session.solve()["status"]
+    'sat'
+    >>> session.update("Solve x + y = 10, x - y = 2 such that x > 0.")
+    >>> result = session.solve()
+    >>> result["model"], result["counts"]
+    ({'x': 6, 'y': 4}, {'parsed': 5, 'lowered': 5})
+    >>> session.update("Solve x + y = 10, x - y = 2 such that x > 0")
+    >>> session.update("Solve x + y = 10, x - y = 2 such that x > 0, y > .")
+    Traceback (most recent call last):
+    ...
+    parsers.ParseError: Expected a constant, variable or '(' but found end of input (at offset 48)
+    """
+    def __init__(self, canonical=True, timeout=None, incremental_timeout=INCREMENTAL_TIMEOUT):
+        self.parser = ParseDiophantine()
+        self.solver = z3.Solver()
+        self.canonical = canonical
+        self.timeout = timeout
+        self.incremental_timeout = incremental_timeout if timeout is None else min(incremental_timeout, timeout)
+        # (kind, normalized text) -> {"node", "term", "literal"} of every statement seen in the session
+        self.statements = {}
+        # auxiliary variables of the powers and their definitions, shared by all the statements
+        self.monomial_terms = {}
+        self.definitions = []
+        self.active = {}
+        self.scopes = []
+        self.timings = {}
+        self.counts = {"parsed": 0, "lowered": 0}
+
+    def add(self, kind, text, offset=0):
+        '''
+        Adds an "equation" or a "constraint" to the problem and returns its key, offset is the
+        index of text in the description it comes from, for the offsets of parse errors
+        '''
+        key = (kind, normalize(text))
+        if key not in self.statements:
+            with phase(self.timings, "parse"):
+                node = self.parser.parse_equation(text, offset) if kind == "equation" else self.parser.parse_constraint(text, offset)
+            self.counts["parsed"] += 1
+            with phase(self.timings, "toz3"):
+                definitions = []
+                term = canonical_toz3(node, self.monomial_terms, definitions) if self.canonical else node.toz3()
+                literal = z3.Bool(f"{AUXILIARY_PREFIX}statement{len(self.statements)}")
+                # definitions hold whatever the statements of the problem, they are not guarded
+                self.solver.add(definitions)
+                self.definitions.extend(definitions)
+                self.solver.add(z3.Implies(literal, term))
+            self.counts["lowered"] += 1
+            self.statements[key] = {"node": node, "term": term, "literal": literal}
+        self.active[key] = None
+        return key
+
+    def add_equation(self, text):
+        return self.add("equation", text)
+
+    def add_constraint(self, text):
+        return self.add("constraint", text)
+
+    def retract(self, key):
+        '''
+        Removes a statement from the problem, it stays known to the session
+        '''
+        if key not in self.active:
+            raise ValueError(f"{key[0].capitalize()} {key[1]!r} is not in the problem")
+        del self.active[key]
+
+    def push(self):
+        self.scopes.append(dict(self.active))
+
+    def pop(self):
+        '''
+        Restores the statements of the problem at the matching push
+        '''
+        if self.scopes == []:
+            raise ValueError("pop without a matching push")
+        self.active = self.scopes.pop()
+
+    def update(self, description):
+        '''
+        Makes the problem the one of a whole description: statements not in it are retracted,
+        the new ones are added, the others are left as they are
+        '''
+        statements = self.parser.split_problem(description)
+        keys = [(kind, normalize(text)) for kind, text, offset in statements]
+        for key in list(self.active):
+            if key not in keys:
+                del self.active[key]
+        for kind, text, offset in statements:
+            self.add(kind, text, offset)
+
+    def solve(self):
+        timings, self.timings = self.timings, {}
+        names = set()
+        for key in self.active:
+            names |= self.statements[key]["node"].variables()
+
+        with phase(timings, "solve"):
+            literals = {self.statements[key]["literal"].get_id(): key for key in self.active}
+            self.solver.set("timeout", int(self.incremental_timeout * 1000))
+            status = self.solver.check(*[self.statements[key]["literal"] for key in self.active])
+            solver, incremental, core = self.solver, True, None
+            if status == z3.unknown:
+                solver, incremental = z3.Solver(), False
+                if self.timeout is not None:
+                    solver.set("timeout", int(self.timeout * 1000))
+                solver.add(self.definitions + [self.statements[key]["term"] for key in self.active])
+                status = solver.check()
+            model = None
+            if status == z3.sat:
+                solution = solver.model()
+                model = {name: solution.eval(z3.Int(name), model_completion=True).as_long() for name in sorted(names)}
+            elif status == z3.unsat and incremental:
+                core = [literals[literal.get_id()] for literal in solver.unsat_core()]
+
+        return {
+            "status": str(status),
+            "model": model,
+            "engine": "session",
+            "core": core,
+            "incremental": incremental,
+            "counts": dict(self.counts),
+            "timings": timings
+        }
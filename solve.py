@@ -1,41 +1,471 @@
-from z3 import *
+from backend import z3
 from parsers import *
+from linear_diophantine import solve_linear_problem
+from polynomial import canonical_toz3, shared_monomials, AUXILIARY_PREFIX
+from bounded_search import solve_bounded_problem
+from classify import classify_problem, make_solver
+from presolve import presolve_problem, recover_model
+from refute import refute_problem
+from profiling import Profiler, phase, count_nodes, count_terms
+import argparse
 
-def solve(description_path):
+def model_to_dict(model):
+    '''
+    Converts a z3 model to a dictionary {variable name: integer value}, keeping z3's order.
+    Auxiliary variables introduced by the encoding are left out
+    '''
+    return {declaration.name(): model[declaration].as_long() for declaration in model.decls() if not declaration.name().startswith(AUXILIARY_PREFIX)}
+
+def format_model(model):
+    '''
+    Formats a model dictionary the same way z3 prints its models
+    '''
+    return "[" + ", ".join(f"{name} = {value}" for name, value in model.items()) + "]"
+
+def error_result(error, timings=None):
+    """
+    Result dictionary reporting an exception raised while solving, for the workers which report
+    errors in their results instead of raising them (batch, daemon and split)
+
+    Example:
+    >>> error_result(ValueError("Unexpected character '#'"), {"total": 0.5})
+    {'status': 'error', 'model': None, 'engine': None, 'error': "ValueError: Unexpected character '#'", 'timings': {'total': 0.5}}
+    """
+    return {
+        "status": "error",
+        "model": None,
+        "engine": None,
+        "error": f"{type(error).__name__}: {error}",
+        "timings": {} if timings is None else timings
+    }
+
+def problem_variables(parsed):
+    '''
+    Returns the sorted names of all the variables in a parsed problem
+    '''
+    names = set()
+    for eq in parsed['equations']:
+        names |= eq.variables()
+    for con in parsed['constraints']:
+        names |= con.variables()
+    return sorted(names)
+
+def lower_problem(parsed, canonical=True, share_monomials=False):
+    '''
+    Returns the z3 terms of all the equations and constraints of a parsed problem. With canonical=True
+    they are lowered through the polynomial normal form, with powers of degree SQUARING_DEGREE or more
+    replaced by auxiliary variables defined by repeated squaring, otherwise with the toz3() methods.
+    With share_monomials=True (canonical only) nonlinear monomials occurring in several relations are
+    replaced by auxiliary variables as well. The definitions of the auxiliary variables are added to the terms
+    '''
+    nodes = list(parsed['equations']) + list(parsed['constraints'])
+    if not canonical:
+        return [node.toz3() for node in nodes]
+    monomial_terms, definitions = shared_monomials(nodes) if share_monomials else ({}, [])
+    terms = [canonical_toz3(node, monomial_terms, definitions) for node in nodes]
+    return definitions + terms
+
+def enumerate_solutions(description, limit=None, variables=None, parser=None):
+    """
+    Lazily yields the solutions of a problem as dictionaries {variable name: value}, at most limit
+    of them. A single incremental solver is kept alive and each solution found is excluded with a
+    blocking clause. If variables is given, solutions are projected onto those variables: only
+    their values are yielded and every projection is yielded once.
+
+    Examples:
+    >>> list(enumerate_solutions("Solve x + y = 2 such that x > 0, y > 0."))
+    [{'x': 1, 'y': 1}]
+    >>> sorted(solution["x"] for solution in enumerate_solutions("Solve x*x = 4."))
+    [-2, 2]
+    >>> len(list(enumerate_solutions("Solve x + y = 0.", limit=3)))
+    3
+    >>> sorted(solution["y"] for solution in enumerate_solutions("Solve y*y + x*x = 1.", variables=["y"]))
+    [-1, 0, 1]
+    """
+    if parser is None:
+        parser = ParseDiophantine()
+    parsed = parser.parse_problem(description)
+
+    names = problem_variables(parsed) if variables is None else list(variables)
+    z3_variables = [z3.Int(name) for name in names]
+
+    solver = z3.Solver()
+    solver.add(lower_problem(parsed))
+
+    found = 0
+    while limit is None or found < limit:
+        if solver.check() != z3.sat:
+            return
+        model = solver.model()
+        values = [model.eval(variable, model_completion=True) for variable in z3_variables]
+        yield {name: value.as_long() for name, value in zip(names, values)}
+        found += 1
+
+        # block this solution (or projection) so that the next check finds a different one
+        solver.add(z3.Or([variable != value for variable, value in zip(z3_variables, values)]))
+
+def solve_parsed(parsed, solver=None, fast_path=True, canonical=True, bounded=True, timings=None, share_monomials=False, profiler=None, timeout=None, select_logic=True, presolve=True, refute=True, classification=None, solvers=None):
+    '''
+    Solves a parsed problem with the first engine that applies (see solve_problem) and returns
+    the result dictionary, adding the time of every phase to timings (and to the profiler if any).
+    The classification of the problem is computed unless given
+    '''
+    if timings is None:
+        timings = {}
+
+    # the problem submitted is classified, not what is left of it after presolve
+    if classification is None:
+        with phase(timings, "classify", profiler):
+            classification = classify_problem(parsed)
+
+    if presolve:
+        with phase(timings, "presolve", profiler):
+            presolved = presolve_problem(parsed)
+        substitutions = presolved["substitutions"]
+        names = problem_variables(parsed)
+        if presolved["status"] is not None:
+            return {
+                "status": presolved["status"],
+                "model": recover_model({}, substitutions, names) if presolved["status"] == "sat" else None,
+                "engine": "presolve",
+                "classification": classification,
+                "eliminated": [name for name, replacement in substitutions],
+                "timings": timings
+            }
+        result = solve_parsed(presolved["parsed"], solver=solver, fast_path=fast_path, canonical=canonical, bounded=bounded,
+                              timings=timings, share_monomials=share_monomials, profiler=profiler, timeout=timeout,
+                              select_logic=select_logic, presolve=False, refute=refute, classification=classification,
+                              solvers=solvers)
+        if result["model"] is not None:
+            result["model"] = recover_model(result["model"], substitutions, names)
+        result["eliminated"] = [name for name, replacement in substitutions]
+        return result
+
+    bounds = None
+    if refute:
+        with phase(timings, "refute", profiler):
+            refutation = refute_problem(parsed)
+        if refutation["status"] == "unsat":
+            return {
+                "status": "unsat",
+                "model": None,
+                "engine": "refute",
+                "certificate": refutation["certificate"],
+                "classification": classification,
+                "timings": timings
+            }
+        bounds = refutation["bounds"]
+
+    if fast_path:
+        with phase(timings, "linear", profiler):
+            linear_result = solve_linear_problem(parsed)
+        if linear_result is not None:
+            return {
+                "status": linear_result["status"],
+                "model": linear_result["model"],
+                "engine": "linear",
+                "classification": classification,
+                "timings": timings
+            }
+
+    if bounded:
+        with phase(timings, "bounded", profiler):
+            bounded_result = solve_bounded_problem(parsed, bounds=bounds)
+        if bounded_result is not None:
+            return {
+                "status": bounded_result["status"],
+                "model": bounded_result["model"],
+                "engine": "bounded",
+                "box_size": bounded_result["box_size"],
+                "classification": classification,
+                "timings": timings
+            }
+
+    # z3 is loaded on first use (see backend.py), which is timed on its own rather than in "toz3"
+    with phase(timings, "backend", profiler):
+        z3.load()
+    with phase(timings, "toz3", profiler):
+        assertions = lower_problem(parsed, canonical, share_monomials)
+    if profiler is not None:
+        profiler.count("z3_terms", count_terms(assertions))
+
+    # solve classes using toz3() methods
+    with phase(timings, "solve", profiler):
+        logic = None
+        if solver is None and select_logic:
+            logic = classification["logic"]
+            solver = make_solver(classification, solvers)
+        elif solver is None:
+            solver = z3.Solver()
+        else:
+            solver.reset()
+        if timeout is not None:
+            solver.set("timeout", int(timeout * 1000))
+        solver.add(assertions)
+
+        # check if problem is solvable
+        status = solver.check()
+        if status == z3.unknown and logic is not None and solver.reason_unknown() not in ("timeout", "canceled"):
+            # the solver of the logic gave up, try again with the default one
+            logic = None
+            solver = z3.Solver()
+            if timeout is not None:
+                solver.set("timeout", int(timeout * 1000))
+            solver.add(assertions)
+            status = solver.check()
+        model = model_to_dict(solver.model()) if status == z3.sat else None
+    if profiler is not None:
+        profiler.record_statistics(solver)
+
+    return {
+        "status": str(status),
+        "model": model,
+        "engine": "z3",
+        "logic": logic,
+        "classification": classification,
+        "timings": timings
+    }
+
+def solve_problem(description, parser=None, solver=None, fast_path=True, canonical=True, bounded=True, cache=None, share_monomials=False, profiler=None, timeout=None, presolve=True, refute=True, solvers=None):
     """
-    Solves a diophantine equation problem given a path to a file containing the problem description. Examples:
-    >>> solve("examples/example1.txt")
-    [z = -11, y = 27, x = -6]
-    >>> solve("examples/example2.txt")
-    [y = 3, z = 0, x = 0, u = 0]
-    >>> solve("examples/example3.txt")
-    [x = 3, z = -1, y = -18]
+    Solves a diophantine equation problem given its description and returns a dictionary with
+    the status ("sat", "unsat" or "unknown"), the model as {variable name: value} (None if there
+    is no model), the engine that solved it and the time spent in every phase in seconds.
+    A parser and a solver can be passed to reuse them between problems, the solver is reset first.
+    A solver passed is used whatever the problem; to reuse solvers and still have z3 set up for
+    the logic of every problem, pass a dictionary solvers instead (see classify.make_solver).
+    Systems of linear equations without constraints are solved exactly by the "linear" engine
+    unless fast_path is False. If bound inference bounds every variable to a small box, the box
+    is searched by the "bounded" engine (unless bounded is False or numpy is missing) and the
+    result also has the "box_size" searched. Everything else goes to z3, lowered through the
+    polynomial normal form unless canonical is False, optionally sharing repeated nonlinear
+    monomials through auxiliary variables (share_monomials=True), and z3 gives up with "unknown"
+    after timeout seconds if a timeout is given. Unless presolve is False, variables defined by
+    linear equations are first eliminated (see presolve.presolve_problem): the result lists them
+    as "eliminated" and its engine is "presolve" if nothing was left to solve. Unless refute is
+    False, cheap proofs of unsatisfiability are looked for before any engine runs (see
+    refute.refute_problem) and the "refute" engine answers with the "certificate" of the one
+    found. Unless a solver is passed, z3 is set up for the logic of the problem (see
+    classify.classify_problem) and the default solver is tried if that one gives up; the result
+    has the "logic" used (None for the default solver). Results computed here have the
+    "classification" of the problem.
+    With a cache (see cache.ResultCache), results of equivalent problems are reused and marked
+    with "cached": True. With a profiler (see profiling.Profiler), CPU times, node and term
+    counts and solver statistics are collected as well and the result has its "profile".
+
+    Examples:
+    >>> result = solve_problem("Solve x*y + z = 3 such that x > 1.")
+    >>> result["engine"], result["status"], sorted(result["model"])
+    ('z3', 'sat', ['x', 'y', 'z'])
+    >>> model = result["model"]
+    >>> model["x"] * model["y"] + model["z"] == 3 and model["x"] > 1
+    True
+    >>> result = solve_problem("Solve 2x + 4y = 6, x - y = 0.")
+    >>> result["engine"], result["status"], result["model"]
+    ('linear', 'sat', {'y': 1, 'x': 1})
+    >>> result = solve_problem("Solve x*y = 6 such that x > 2, x < 5, y > 0, y < 4.")
+    >>> result["engine"], result["status"], result["model"], result["box_size"]
+    ('bounded', 'sat', {'x': 3, 'y': 2}, 6)
+    >>> result = solve_problem("Solve x*x - 3*y*y = 2.")
+    >>> result["engine"], result["status"], result["certificate"]["kind"], result["certificate"]["modulus"]
+    ('refute', 'unsat', 'modulus', 3)
+    """
+    timings = {}
+    if parser is None:
+        parser = ParseDiophantine()
+
+    # parse expression and instantiate classes
+    with phase(timings, "parse", profiler):
+        parsed = parser.parse_problem(description)
+    if profiler is not None:
+        profiler.count("ast_nodes", count_nodes(parsed["equations"] + parsed["constraints"]))
+
+    if cache is not None:
+        with phase(timings, "cache", profiler):
+            cached_result = cache.lookup(parsed)
+        if cached_result is not None:
+            result = {**cached_result, "cached": True, "timings": timings}
+            if profiler is not None:
+                result["profile"] = profiler.report()
+            return result
+
+    result = solve_parsed(parsed, solver=solver, fast_path=fast_path, canonical=canonical, bounded=bounded, timings=timings,
+                          share_monomials=share_monomials, profiler=profiler, timeout=timeout, presolve=presolve, refute=refute,
+                          solvers=solvers)
+
+    if cache is not None:
+        cache.store(parsed, result)
+    if profiler is not None:
+        result["profile"] = profiler.report()
+    return result
+
+def solve_stream(description_path, solver=None, canonical=True, chunk_size=CHUNK_SIZE, profiler=None, timeout=None):
+    """
+    Solves a problem read from a file in chunks, adding every equation and constraint to the
+    solver as soon as it is parsed and lowered, so that only one of them is in memory at a time
+    on the Python side. The whole problem is never available, so the linear and bounded engines
+    and the cache are not used: the problem always goes to z3. Returns the same dictionary as
+    solve_problem, where the "parse" and "toz3" timings are the totals over all the statements
+    (reading the file is counted in "parse"), and loading z3 is counted in "backend". z3 gives up after timeout seconds if a timeout is given.
+
+    Example:
+    >>> result = solve_stream("examples/example3.txt", chunk_size=16)
+    >>> result["engine"], result["status"], sorted(result["model"])
+    ('z3', 'sat', ['x', 'y', 'z'])
+    >>> solve_stream("examples/example4.txt")["status"]
+    'unsat'
+    """
+    timings = {"parse": 0.0, "toz3": 0.0}
+    with phase(timings, "backend", profiler):
+        z3.load()
+    if solver is None:
+        solver = z3.Solver()
+    else:
+        solver.reset()
+    if timeout is not None:
+        solver.set("timeout", int(timeout * 1000))
+
+    # auxiliary variables of the powers are shared by all the statements
+    monomial_terms = {}
+    statements = ParseDiophantine().stream_problem(read_chunks(description_path, chunk_size))
+    while True:
+        with phase(timings, "parse", profiler):
+            statement = next(statements, None)
+        if statement is None:
+            break
+
+        kind, node = statement
+        if profiler is not None:
+            profiler.count("ast_nodes", count_nodes([node]))
+        with phase(timings, "toz3", profiler):
+            definitions = []
+            term = canonical_toz3(node, monomial_terms, definitions) if canonical else node.toz3()
+            solver.add(definitions + [term])
+        if profiler is not None:
+            profiler.count("z3_terms", count_terms(definitions + [term]))
+
+    with phase(timings, "solve", profiler):
+        status = solver.check()
+        model = model_to_dict(solver.model()) if status == z3.sat else None
+    if profiler is not None:
+        profiler.record_statistics(solver)
+
+    result = {
+        "status": str(status),
+        "model": model,
+        "engine": "z3",
+        "timings": timings
+    }
+    if profiler is not None:
+        result["profile"] = profiler.report()
+    return result
+
+def solve(description_path, solutions=1, stream=False, profile=False, timeout=None, portfolio=False, split=False, all_solutions=False):
+    """
+    Solves a diophantine equation problem given a path to a file containing the problem description.
+    With solutions > 1 up to that many different solutions are printed, one per line. With
+    stream=True the file is read and solved piece by piece (see solve_stream). With profile=True
+    a report of the time, node and term counts and solver statistics is printed after the model
+    (see profiling.Profiler). z3 gives up after timeout seconds if given, and with portfolio=True
+    several solver configurations race in parallel (see portfolio.solve_portfolio). With split=True
+    the constraints are split into branches solved in parallel (see split.solve_split). With
+    all_solutions=True every solution is printed, followed by their number, enumerating ranges
+    of the bounded variables in parallel (see enumeration.enumerate_partitioned), at most solutions
+    of them if solutions > 1; this raises a ValueError if some variable is not bounded and there
+    is no such limit. Streaming only
+    finds one solution with the default solver: stream=True with solutions > 1, portfolio, split
+    or all_solutions raises a ValueError. The model z3
+    finds depends on the order in which terms were built, so the examples check that the printed
+    model satisfies the problem rather than which model it is.
+
+    Examples:
+    >>> import contextlib, io
+    >>> for path in ["examples/example1.txt", "examples/example2.txt", "examples/example3.txt", "examples/example5.txt"]:
+    ...     output = io.StringIO()
+    ...     with contextlib.redirect_stdout(output):
+    ...         solve(path)
+    ...     model = dict((name, int(value)) for name, value in (pair.split(" = ") for pair in output.getvalue().strip()[1:-1].split(", ")))
+    ...     parsed = ParseDiophantine().parse_problem(open(path).read())
+    ...     print(path, all(node.evaluate(model) for node in parsed["equations"] + parsed["constraints"]))
+    examples/example1.txt True
+    examples/example2.txt True
+    examples/example3.txt True
+    examples/example5.txt True
     >>> solve("examples/example4.txt")
     No solution!
-    >>> solve("examples/example5.txt")
-    [t = 6, v = -5, u = 7, z = -8, x = 1, y = -2]
+    >>> solve("examples/example4.txt", stream=True, split=True)
+    Traceback (most recent call last):
+    ...
+    ValueError: stream cannot be combined with split
     """
+    profiler = Profiler() if profile else None
+    if stream:
+        options = {"solutions": solutions > 1, "portfolio": portfolio, "split": split, "all": all_solutions}
+        unsupported = [name for name, value in options.items() if value]
+        if unsupported:
+            raise ValueError(f"stream cannot be combined with {', '.join(unsupported)}")
+        result = solve_stream(description_path, profiler=profiler, timeout=timeout)
+        print_result(result)
+        if profiler is not None:
+            print(profiler.format())
+        return
+
     file = open(description_path).read()
 
-    # parse expression and instantiate classes
-    parser = ParseDiophantine()
-    parsed = parser.parse_problem(file)
+    # the modules imported here (enumeration, portfolio, split) themselves build on this one
+    if all_solutions:
+        from enumeration import enumerate_partitioned
+        counts = {}
+        limit = solutions if solutions > 1 else None
+        for model in enumerate_partitioned(ParseDiophantine().parse_problem(file), limit=limit, counts=counts):
+            print(format_model(model))
+        print(f"{counts['solutions']} solutions")
+        return
 
-    equations = []
-    constraints = []
-    for eq in parsed['equations']:
-        equations.append(eq.toz3())
-    for con in parsed['constraints']:
-        constraints.append(con.toz3())
+    if solutions > 1:
+        models = list(enumerate_solutions(file, limit=solutions))
+        for model in models:
+            print(format_model(model))
+        if models == []:
+            print("No solution!")
+        return
 
-    # solve classes using toz3() methods
-    solver = Solver()
-    solver.add(equations)
-    solver.add(constraints)
+    if portfolio:
+        from portfolio import solve_portfolio, TIMEOUT
+        result = solve_portfolio(file, timeout=TIMEOUT if timeout is None else timeout)
+    elif split:
+        from split import solve_split
+        result = solve_split(file, timeout=timeout)
+    else:
+        result = solve_problem(file, profiler=profiler, timeout=timeout)
 
-    # check if problem is solvable
-    if solver.check() == sat:
-        model = solver.model()
-        print(model)
+    print_result(result)
+    if profiler is not None:
+        print(profiler.format())
+
+def print_result(result):
+    if result["status"] == "sat":
+        print(format_model(result["model"]))
+    elif result["status"] == "unknown":
+        print("Unknown, no answer within the limits")
     else:
         print("No solution!")
+
+def main(arguments=None):
+    argument_parser = argparse.ArgumentParser(description="Solve a diophantine equation problem file")
+    argument_parser.add_argument("path", help="problem file")
+    argument_parser.add_argument("-n", "--solutions", type=int, default=1, help="number of different solutions to print")
+    argument_parser.add_argument("--stream", action="store_true", help="read and solve the file piece by piece")
+    argument_parser.add_argument("--profile", action="store_true", help="print the time of every phase, node and term counts and solver statistics")
+    argument_parser.add_argument("--timeout", type=float, default=None, help="seconds after which the problem is given up as unknown")
+    argument_parser.add_argument("--portfolio", action="store_true", help="race several solver configurations in parallel processes")
+    argument_parser.add_argument("--split", action="store_true", help="split the 'or' constraints into branches solved in parallel processes")
+    argument_parser.add_argument("--all", action="store_true", help="print all the solutions (at most SOLUTIONS with -n), enumerated in parallel processes")
+    arguments = argument_parser.parse_args(arguments)
+    try:
+        solve(arguments.path, arguments.solutions, arguments.stream, arguments.profile, arguments.timeout, arguments.portfolio, arguments.split, arguments.all)
+    except ValueError as error:
+        argument_parser.error(str(error))
+
+if __name__ == "__main__":
+    main()
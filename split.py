@@ -0,0 +1,169 @@
+import multiprocessing
+import time
+
+from symbolic_classes import postorder, Conjunction, OrUnion
+from polynomial import boolean_operands
+from parsers import ParseDiophantine
+from solve import solve_parsed, problem_variables, error_result
+
+# Splitting of disjunctive constraints
+#
+# A constraint is a tree of 'and' and 'or' over relations. Written in disjunctive
+# normal form it is a union of cubes, conjunctions of relations, and a problem
+# whose constraints are all split that way is the union of the problems made of
+# its equations and one cube of every constraint: the branches. Branches are
+# independent, so they are solved in parallel processes; the problem has a
+# solution as soon as one branch has one and none if no branch has one. The
+# number of branches grows as the product of the number of cubes, so splitting
+# is capped: constraints are split, those with the fewest cubes first, as long as
+# there are at most MAX_BRANCHES branches, and the others are left whole in every
+# branch for z3 to case-split (cube and conquer).
+
+MAX_BRANCHES = 32
+
+def cubes(node, limit=MAX_BRANCHES):
+    """
+    Returns the disjunctive normal form of a constraint as a list of cubes, each a list of
+    relations, or None if it has more than limit cubes.
+
+    Example:
+    >>> constraint = ParseDiophantine().parse_constraint("x > 5 or x < -5 and (y > 0 or z < 0)")
+    >>> [[str(relation) for relation in cube] for cube in cubes(constraint)]
+    [['(x > 5)'], ['(x < -5)', '(y > 0)'], ['(x < -5)', '(z < 0)']]
+    >>> cubes(constraint, limit=2) is None
+    True
+    """
+    forms = {}
+    for current in postorder(node, boolean_operands):
+        operands = [forms[id(operand)] for operand in boolean_operands(current)]
+        if None in operands:
+            forms[id(current)] = None
+        elif isinstance(current, OrUnion):
+            form = [cube for operand in operands for cube in operand]
+            forms[id(current)] = form if len(form) <= limit else None
+        elif isinstance(current, Conjunction):
+            form = [[]]
+            for operand in operands:
+                if len(form) * len(operand) > limit:
+                    form = None
+                    break
+                form = [cube + other for cube in form for other in operand]
+            forms[id(current)] = form
+        else:
+            forms[id(current)] = [[current]]
+    return forms[id(node)]
+
+def split_problem(parsed, limit=MAX_BRANCHES):
+    """
+    Returns the branches of a parsed problem, at most limit of them, as parsed problems:
+    the equations, one cube of every split constraint and the constraints left whole.
+
+    Example:
+    >>> parsed = ParseDiophantine().parse_problem(open("examples/example5.txt").read())
+    >>> branches = split_problem(parsed)
+    >>> len(branches), [str(node) for node in branches[1]["constraints"]]
+    (4, ['(x > 0)', '(v < 0)', '(z < 0)', '(y < 0)', '(t > 0)', '(v < 0)'])
+    >>> len(split_problem(parsed, limit=2))
+    2
+    """
+    forms = [(cubes(constraint, limit), position) for position, constraint in enumerate(parsed["constraints"])]
+    # splitting the constraints with the fewest cubes first gets the most of them split within the cap
+    order = sorted((len(form), position) for form, position in forms if form is not None)
+
+    branches = [[]]
+    split = set()
+    for size, position in order:
+        if len(branches) * size > limit:
+            break
+        form = forms[position][0]
+        branches = [branch + [(position, cube)] for branch in branches for cube in form]
+        split.add(position)
+
+    problems = []
+    for branch in branches:
+        cube_of = dict(branch)
+        constraints = []
+        for position, constraint in enumerate(parsed["constraints"]):
+            constraints.extend(cube_of[position] if position in split else [constraint])
+        problems.append({"equations": list(parsed["equations"]), "constraints": constraints})
+    return problems
+
+def solve_branch(task):
+    '''
+    Solves one branch in a worker, errors are reported in the result instead of raised
+    '''
+    index, branch, timeout = task
+    start = time.perf_counter()
+    try:
+        result = solve_parsed(branch, timeout=timeout)
+    except Exception as error:
+        result = error_result(error)
+    result["wall"] = time.perf_counter() - start
+    return index, result
+
+def solve_split(description, limit=MAX_BRANCHES, processes=None, timeout=None):
+    """
+    Solves a problem by splitting its constraints into branches (see split_problem) solved in
+    parallel by processes worker processes (one per core by default). Returns as soon as a
+    branch is satisfiable, the other workers are stopped; the status is "unsat" if every branch
+    is unsatisfiable and "unknown" otherwise, also when timeout seconds pass without an answer.
+    The result tells which branch was satisfiable ("branch") and has, for every branch, its
+    constraints, status, engine, timings and wall time in the worker ("branches"), with
+    status "cancelled" for the branches stopped or never started.
+
+    Examples:
+    >>> description = open("examples/example5.txt").read()
+    >>> result = solve_split(description)
+    >>> result["engine"], result["status"], len(result["branches"])
+    ('split', 'sat', 4)
+    >>> parsed = ParseDiophantine().parse_problem(description)
+    >>> all(node.evaluate(result["model"]) for node in parsed["equations"] + parsed["constraints"])
+    True
+    >>> result = solve_split(open("examples/example4.txt").read())
+    >>> result["status"], [branch["status"] for branch in result["branches"]]
+    ('unsat', ['unsat', 'unsat'])
+    >>> sorted(solve_split("Solve x*x = 4 such that x > 0 or y > 0.", processes=1)["model"].items())
+    [('x', 2), ('y', 0)]
+    """
+    timings = {}
+    start = time.perf_counter()
+    parsed = ParseDiophantine().parse_problem(description)
+    timings["parse"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    branches = split_problem(parsed, limit)
+    timings["split"] = time.perf_counter() - start
+
+    reports = [{"constraints": [str(node) for node in branch["constraints"]], "status": "cancelled"} for branch in branches]
+    status, model, winner = "unsat", None, None
+    start = time.perf_counter()
+    deadline = None if timeout is None else start + timeout
+    tasks = [(index, branch, timeout) for index, branch in enumerate(branches)]
+    with multiprocessing.Pool(min(processes or multiprocessing.cpu_count(), len(branches))) as pool:
+        # leaving the with block terminates the workers still solving
+        results = pool.imap_unordered(solve_branch, tasks)
+        for _ in tasks:
+            try:
+                remaining = None if deadline is None else max(deadline - time.perf_counter(), 0)
+                index, result = results.next(remaining)
+            except multiprocessing.TimeoutError:
+                status = "unknown"
+                break
+            reports[index].update({key: result[key] for key in ("status", "engine", "timings", "wall")})
+            if result["status"] == "sat":
+                # variables only in the other cubes of a constraint can take any value
+                model = {**result["model"], **{name: 0 for name in problem_variables(parsed) if name not in result["model"]}}
+                status, winner = "sat", index
+                break
+            if result["status"] != "unsat":
+                status = "unknown"
+    timings["branches"] = time.perf_counter() - start
+
+    return {
+        "status": status,
+        "model": model,
+        "engine": "split",
+        "branch": winner,
+        "branches": reports,
+        "timings": timings
+    }
@@ -1,154 +1,461 @@
-from z3 import *
+from backend import z3
+
+def postorder(roots, operands=None, skip=None):
+    """
+    Yields every distinct node reachable from the roots (a node or a list of nodes) after
+    all of its operands, using an explicit stack so that deep trees do not hit the recursion
+    limit. operands(node) gives the nodes to visit below a node (node.operands() by default)
+    and nodes for which skip(node) is true are neither expanded nor yielded.
+
+    Example:
+    >>> x, y = Variable("x"), Variable("y")
+    >>> [str(node) for node in postorder(Addition(x, Addition(y, x)))]
+    ['x', 'y', '(x + (y + x))']
+    """
+    if operands is None:
+        operands = lambda node: node.operands()
+    if isinstance(roots, Node):
+        roots = [roots]
+    visited = set()
+    stack = [(root, False) for root in reversed(roots)]
+    while stack:
+        node, expanded = stack.pop()
+        if id(node) in visited or (skip is not None and skip(node)):
+            continue
+        if expanded:
+            visited.add(id(node))
+            yield node
+            continue
+        stack.append((node, True))
+        stack.extend((operand, False) for operand in reversed(operands(node)) if id(operand) not in visited)
+
+def arithmetic_term(make, terms):
+    # builds the n-ary z3 term directly: the operands are known to be integers, so the
+    # sort checks and coercions done by Sum and Product (the bulk of the lowering time) are skipped
+    ctx = terms[0].ctx
+    array = (z3.Ast * len(terms))(*(term.as_ast() for term in terms))
+    return z3.ArithRef(make(ctx.ref(), len(terms), array), ctx)
+
+# Powers of this degree or more are built by repeated squaring instead of as products of
+# as many factors as their degree
+SQUARING_DEGREE = 4
+
+def power_term(base, exponent):
+    # x ^ k is the product of k factors x below SQUARING_DEGREE, as x * ... * x was, and
+    # x ^ (k // 2) * x ^ (k - k // 2) from there, so that z3 shares the powers of half the degree
+    if exponent == 0:
+        return z3.IntVal(1, base.ctx)
+    if exponent < SQUARING_DEGREE:
+        return base if exponent == 1 else arithmetic_term(z3.Z3_mk_mul, [base] * exponent)
+    terms = {}
+    stack = [exponent]
+    while stack:
+        current = stack.pop()
+        if current in terms:
+            continue
+        halves = [part for part in (current // 2, current - current // 2) if part >= SQUARING_DEGREE and part not in terms]
+        if halves:
+            stack.append(current)
+            stack.extend(halves)
+            continue
+        factors = [terms[part] if part >= SQUARING_DEGREE else power_term(base, part) for part in (current // 2, current - current // 2)]
+        terms[current] = arithmetic_term(z3.Z3_mk_mul, factors)
+    return terms[exponent]
+
+class Node:
+    """
+    Base of all the symbolic classes. Nodes use __slots__ and cache their z3 term once per
+    z3 context, so a node shared by several equations (see NodeFactory) is lowered once.
+    Nodes must not be modified after their z3 term has been built.
+
+    All the passes over the nodes (toz3, evaluate, variables, str, pickling) use explicit
+    stacks, so they work on trees of any depth. They see chains of the same associative
+    operation, e.g. x + (y + (z + t)), as a single n-ary node (see operands).
+
+    Example:
+    >>> import pickle
+    >>> expression = Variable("x")
+    >>> for value in range(5000):
+    ...     expression = Addition(Constant(value), expression)
+    >>> copy = pickle.loads(pickle.dumps(expression))
+    >>> copy.evaluate({"x": 1}), str(copy) == str(expression)
+    (12497501, True)
+    """
+    __slots__ = ("z3_terms",)
+
+    def children(self):
+        return ()
+
+    def operands(self):
+        return self.children()
+
+    def cached_term(self, ctx):
+        return None if self.z3_terms is None else self.z3_terms.get(ctx)
+
+    def toz3(self, ctx=None):
+        term = self.cached_term(ctx)
+        if term is not None:
+            return term
+        for node in postorder(self, skip=lambda node: node.cached_term(ctx) is not None):
+            if node.z3_terms is None:
+                node.z3_terms = {}
+            node.z3_terms[ctx] = node.z3_term(ctx, [operand.cached_term(ctx) for operand in node.operands()])
+        return self.z3_terms[ctx]
+
+    def evaluate(self, variable_values):
+        values = {}
+        for node in postorder(self):
+            values[id(node)] = node.compute([values[id(operand)] for operand in node.operands()], variable_values)
+        return values[id(self)]
+
+    def variables(self):
+        return {node.name for node in postorder(self) if isinstance(node, Variable)}
+
+    def __str__(self):
+        # the pieces of the text are written left to right, nodes are replaced by their pieces
+        pieces = []
+        stack = [self]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, str):
+                pieces.append(item)
+            elif item.children() == ():
+                pieces.append(item.label())
+            else:
+                opening, closing = item.brackets
+                left_expression, right_expression = item.children()
+                stack.extend((closing, right_expression, f" {item.symbol} ", left_expression, opening))
+        return "".join(pieces)
+
+    def slot_names(self):
+        return [name for cls in type(self).__mro__ for name in getattr(cls, "__slots__", ()) if name != "z3_terms"]
+
+    # z3 terms cannot be pickled, they are dropped and rebuilt on demand
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.slot_names()}
+
+    def __setstate__(self, state):
+        self.z3_terms = None
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def __reduce__(self):
+        # pickle would recurse once per level of the tree, so the nodes below this one are
+        # written as a flat list of states, children first, with children replaced by their index
+        indices = {}
+        records = []
+        for node in postorder(self, lambda node: node.children()):
+            state = node.__getstate__()
+            children = tuple(name for name, value in state.items() if isinstance(value, Node))
+            for name in children:
+                state[name] = indices[id(state[name])]
+            indices[id(node)] = len(records)
+            records.append((type(node), state, children))
+        return (rebuild_nodes, (records,))
+
+def rebuild_nodes(records):
+    '''
+    Rebuilds the nodes pickled by Node.__reduce__ and returns the last one
+    '''
+    nodes = []
+    for cls, state, children in records:
+        node = cls.__new__(cls)
+        node.__setstate__({name: nodes[value] if name in children else value for name, value in state.items()})
+        nodes.append(node)
+    return nodes[-1]
+
+class Equation(Node):
+    __slots__ = ("left_expression", "right_expression")
+    symbol = "="
+    brackets = ("", "")
 
-class Equation:
     def __init__(self, left_expression, right_expression):
+        self.z3_terms = None
         self.left_expression = left_expression
         self.right_expression = right_expression
 
-    def __str__(self):
-        return f"{self.left_expression} = {self.right_expression}"
-    
-    def toz3(self):
-        return self.left_expression.toz3() == self.right_expression.toz3()
+    def children(self):
+        return (self.left_expression, self.right_expression)
+
+    def z3_term(self, ctx, terms):
+        return terms[0] == terms[1]
+
+    def compute(self, values, variable_values):
+        return values[0] == values[1]
+
+class Expression(Node):
+    __slots__ = ()
 
-class Expression:
     def __add__(self, other):
         return Addition(self, other)
-    
+
     def __mul__(self, other):
         return Multiplication(self, other)
 
 class Variable(Expression):
+    __slots__ = ("name",)
+
     def __init__(self, name):
+        self.z3_terms = None
         self.name = name
 
-    def __str__(self):
+    def label(self):
         return self.name
-    
+
     def __repr__(self):
         return f"Variable({self.name})"
-    
-    def toz3(self):
-        return Int(self.name)
-    
-    def evaluate(self, variable_values):
+
+    def z3_term(self, ctx, terms):
+        return z3.Int(self.name, ctx)
+
+    def compute(self, values, variable_values):
         return variable_values[self.name]
 
 class Constant(Expression):
+    __slots__ = ("value",)
+
     def __init__(self, value):
+        self.z3_terms = None
         self.value = value
 
-    def __str__(self):
+    def label(self):
         return str(self.value)
-    
+
     def __repr__(self):
         return f"Constant({self.value})"
-    
-    def evaluate(self, variable_values):
-        return self.value
-    
-    def toz3(self):
+
+    def compute(self, values, variable_values):
         return self.value
 
+    def z3_term(self, ctx, terms):
+        return z3.IntVal(self.value, ctx)
+
 class BinaryOperation(Expression):
+    __slots__ = ("left_expression", "right_expression")
+    brackets = ("(", ")")
+
     def __init__(self, left_expression, right_expression):
+        self.z3_terms = None
         self.left_expression = left_expression
         self.right_expression = right_expression
 
-class Addition(BinaryOperation):
+    def children(self):
+        return (self.left_expression, self.right_expression)
+
+class AssociativeOperation(BinaryOperation):
+    """
+    Operation whose chains are flattened: the operands of x + (y + (z + t)) are x, y, z and t
+    """
+    __slots__ = ()
+
+    def operands(self):
+        operands = []
+        stack = [self.right_expression, self.left_expression]
+        while stack:
+            node = stack.pop()
+            if type(node) is type(self):
+                stack.extend((node.right_expression, node.left_expression))
+            else:
+                operands.append(node)
+        return operands
+
+class Addition(AssociativeOperation):
+    __slots__ = ()
+    symbol = "+"
+
     def __init__(self, left_expression=None, right_expression=None):
         super().__init__(left_expression, right_expression)
-    
-    def __str__(self):
-        return f"({self.left_expression} + {self.right_expression})"
-    
+
     def __repr__(self):
         return f"Addition({self.left_expression}, {self.right_expression})"
-    
-    def toz3(self):
-        return Sum(self.left_expression.toz3(), self.right_expression.toz3())
-    
-    def evaluate(self, variable_values):
-        return self.left_expression.evaluate(variable_values) + self.right_expression.evaluate(variable_values)
 
-class Multiplication(BinaryOperation):
+    def z3_term(self, ctx, terms):
+        return arithmetic_term(z3.Z3_mk_add, terms)
+
+    def compute(self, values, variable_values):
+        return sum(values)
+
+class Multiplication(AssociativeOperation):
+    __slots__ = ()
+    symbol = "*"
+
     def __init__(self, left_expression=None, right_expression=None):
         super().__init__(left_expression, right_expression)
 
-    def __str__(self):
-        return f"({self.left_expression} * {self.right_expression})"
-    
     def __repr__(self):
         return f"Multiplication({self.left_expression}, {self.right_expression})"
-    
-    def toz3(self):
-        return Product(self.left_expression.toz3(), self.right_expression.toz3())
 
-    def evaluate(self, variable_values):
-        return self.left_expression.evaluate(variable_values) * self.right_expression.evaluate(variable_values)
+    def z3_term(self, ctx, terms):
+        return arithmetic_term(z3.Z3_mk_mul, terms)
+
+    def compute(self, values, variable_values):
+        product = 1
+        for value in values:
+            product *= value
+        return product
+
+class Power(BinaryOperation):
+    """
+    A base raised to a non-negative integer exponent, kept as a Constant right operand.
+    The exponent is not an operand of the power: passes over the operands only see the base.
+
+    Example:
+    >>> cube = Power(Variable("x"), Constant(3))
+    >>> print(cube)
+    (x ^ 3)
+    >>> cube.evaluate({"x": -2}), cube.toz3()
+    (-8, x*x*x)
+    >>> from profiling import count_terms
+    >>> count_terms([Power(Variable("x"), Constant(10 ** 6)).toz3()])
+    33
+    """
+    __slots__ = ()
+    symbol = "^"
+
+    def __init__(self, left_expression=None, right_expression=None):
+        super().__init__(left_expression, right_expression)
+
+    @property
+    def exponent(self):
+        return self.right_expression.value
+
+    def operands(self):
+        return (self.left_expression,)
+
+    def __repr__(self):
+        return f"Power({self.left_expression}, {self.exponent})"
+
+    def z3_term(self, ctx, terms):
+        return power_term(terms[0], self.exponent)
+
+    def compute(self, values, variable_values):
+        return values[0] ** self.exponent
+
+class Conjunction(AssociativeOperation):
+    __slots__ = ()
+    symbol = "and"
 
-class Conjunction(BinaryOperation):
     def __init__(self, left_expression=None, right_expression=None):
         super().__init__(left_expression, right_expression)
 
-    def __str__(self):
-        return f"({self.left_expression} and {self.right_expression})"
-    
     def __repr__(self):
         return f"Conjunction({self.left_expression}, {self.right_expression})"
-    
-    def toz3(self):
-        return And(self.left_expression.toz3(), self.right_expression.toz3())
 
-    def evaluate(self, variable_values):
-        return self.left_expression.evaluate(variable_values) and self.right_expression.evaluate(variable_values)
-    
-class OrUnion(BinaryOperation):
+    def z3_term(self, ctx, terms):
+        return z3.And(terms)
+
+    def compute(self, values, variable_values):
+        return all(values)
+
+class OrUnion(AssociativeOperation):
+    __slots__ = ()
+    symbol = "or"
+
     def __init__(self, left_expression=None, right_expression=None):
         super().__init__(left_expression, right_expression)
 
-    def __str__(self):
-        return f"({self.left_expression} or {self.right_expression})"
-    
     def __repr__(self):
         return f"Union({self.left_expression}, {self.right_expression})"
-    
-    def toz3(self):
-        return Or(self.left_expression.toz3(), self.right_expression.toz3())
 
-    def evaluate(self, variable_values):
-        return self.left_expression.evaluate(variable_values) or self.right_expression.evaluate(variable_values)
-    
+    def z3_term(self, ctx, terms):
+        return z3.Or(terms)
+
+    def compute(self, values, variable_values):
+        return any(values)
+
 class GreaterThan(BinaryOperation):
+    __slots__ = ()
+    symbol = ">"
+
     def __init__(self, left_expression=None, right_expression=None):
         super().__init__(left_expression, right_expression)
 
-    def __str__(self):
-        return f"({self.left_expression} > {self.right_expression})"
-    
     def __repr__(self):
         return f"GreaterThan({self.left_expression}, {self.right_expression})"
-    
-    def toz3(self):
-        return self.left_expression.toz3() > self.right_expression.toz3()
 
-    def evaluate(self, variable_values):
-        return self.left_expression.evaluate(variable_values) > self.right_expression.evaluate(variable_values)
-    
+    def z3_term(self, ctx, terms):
+        return terms[0] > terms[1]
+
+    def compute(self, values, variable_values):
+        return values[0] > values[1]
+
 class LessThan(BinaryOperation):
+    __slots__ = ()
+    symbol = "<"
+
     def __init__(self, left_expression=None, right_expression=None):
         super().__init__(left_expression, right_expression)
 
-    def __str__(self):
-        return f"({self.left_expression} < {self.right_expression})"
-    
     def __repr__(self):
         return f"LessThan({self.left_expression}, {self.right_expression})"
-    
-    def toz3(self):
-        return self.left_expression.toz3() < self.right_expression.toz3()
 
-    def evaluate(self, variable_values):
-        return self.left_expression.evaluate(variable_values) < self.right_expression.evaluate(variable_values)
+    def z3_term(self, ctx, terms):
+        return terms[0] < terms[1]
+
+    def compute(self, values, variable_values):
+        return values[0] < values[1]
+
+class NodeFactory:
+    """
+    Builds nodes of the symbolic classes keeping structurally identical nodes unique (hash-consing),
+    so repeated subexpressions are shared in a DAG instead of being duplicated.
+
+    Example:
+    >>> factory = NodeFactory()
+    >>> x = factory.make(Variable, "x")
+    >>> square = factory.make(Multiplication, x, factory.make(Variable, "x"))
+    >>> square is factory.make(Multiplication, factory.make(Variable, "x"), x), len(factory)
+    (True, 2)
+    """
+    __slots__ = ("nodes",)
+
+    def __init__(self):
+        self.nodes = {}
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def make(self, cls, *arguments):
+        # children are already unique, so they are identified by their id
+        key = (cls,) + tuple(id(argument) if isinstance(argument, Node) else argument for argument in arguments)
+        node = self.nodes.get(key)
+        if node is None:
+            node = cls(*arguments)
+            self.nodes[key] = node
+        return node
+
+    def power(self, base, exponent):
+        '''
+        Builds base ^ exponent, with (b ^ j) ^ k folded into b ^ (j * k) and b ^ 1 into b
+        '''
+        if exponent == 1:
+            return base
+        if isinstance(base, Power):
+            base, exponent = base.left_expression, base.exponent * exponent
+        return self.make(Power, base, self.make(Constant, exponent))
+
+    def multiply(self, left, right):
+        """
+        Builds left * right, normalizing chains of the same factor into powers: the factor is
+        merged with the first factor of right if they have the same base. Products of constants
+        are left as they are.
+
+        Example:
+        >>> factory = NodeFactory()
+        >>> x, y = factory.make(Variable, "x"), factory.make(Variable, "y")
+        >>> print(factory.multiply(x, factory.multiply(x, factory.multiply(x, y))))
+        ((x ^ 3) * y)
+        >>> print(factory.multiply(factory.power(x, 2), factory.power(x, 2)))
+        (x ^ 4)
+        """
+        first, rest = (right.left_expression, right.right_expression) if isinstance(right, Multiplication) else (right, None)
+        base, exponent = power_parts(left)
+        first_base, first_exponent = power_parts(first)
+        if base is not first_base or isinstance(base, Constant):
+            return self.make(Multiplication, left, right)
+        merged = self.power(base, exponent + first_exponent)
+        return merged if rest is None else self.make(Multiplication, merged, rest)
 
-#############################################
+def power_parts(node):
+    # (base, exponent) of a node seen as a power, x is x ^ 1
+    return (node.left_expression, node.exponent) if isinstance(node, Power) else (node, 1)
@@ -0,0 +1,132 @@
+import argparse
+import sys
+
+from symbolic_classes import postorder, Equation, Conjunction, OrUnion, GreaterThan, LessThan
+from parsers import ParseDiophantine, ParseError
+from polynomial import Polynomial, boolean_operands
+from cache import canonical_problem
+
+# Validation of problems
+#
+# Checking that problems parse, and rewriting them in canonical form, only needs
+# the symbolic classes and polynomials: nothing here uses z3, so neither importing
+# this module nor validating loads the z3 library (see backend.py). In canonical
+# form every relation is written as a polynomial in normal form compared with a
+# constant, and the key of the problem is the one of the result cache, which is the
+# same for problems differing only in the order of their statements or operands or
+# in the names of their variables.
+
+def polynomial_text(polynomial):
+    '''
+    Text of a polynomial in the language of grammar.md, e.g. 2*x^2*y - y + 3
+    '''
+    text = ""
+    for monomial, coefficient in polynomial.sorted_terms():
+        factors = [name if exponent == 1 else f"{name}^{exponent}" for name, exponent in monomial]
+        if factors == [] or abs(coefficient) != 1:
+            factors.insert(0, str(abs(coefficient)))
+        if text == "":
+            text = ("-" if coefficient < 0 else "") + "*".join(factors)
+        else:
+            text += (" - " if coefficient < 0 else " + ") + "*".join(factors)
+    return text if text != "" else "0"
+
+def relation_text(node):
+    '''
+    Canonical text of a relation: its variable part in normal form, compared with its constant
+    '''
+    polynomial = Polynomial.from_relation(node)
+    constant = polynomial.constant()
+    left = polynomial - Polynomial({(): constant})
+    if isinstance(node, Equation) and left.terms and left.leading_coefficient() < 0:
+        left, constant = -left, -constant
+    symbol = {Equation: "=", GreaterThan: ">", LessThan: "<"}[type(node)]
+    return f"{polynomial_text(left)} {symbol} {-constant}"
+
+def constraint_text(node):
+    texts = {}
+    for current in postorder(node, boolean_operands):
+        if isinstance(current, (Conjunction, OrUnion)):
+            operator = " and " if isinstance(current, Conjunction) else " or "
+            operands = [texts[id(operand)] for operand in current.operands()]
+            # operands which are themselves 'and' or 'or' are put in parentheses
+            operands = [f"({text})" if isinstance(operand, (Conjunction, OrUnion)) else text
+                        for text, operand in zip(operands, current.operands())]
+            texts[id(current)] = operator.join(operands)
+        else:
+            texts[id(current)] = relation_text(current)
+    return texts[id(node)]
+
+def canonical_text(parsed):
+    '''
+    Text of a parsed problem in canonical form, which parses back to the same problem
+    '''
+    text = "Solve " + ", ".join(relation_text(node) for node in parsed["equations"])
+    if parsed["constraints"]:
+        text += " such that " + ", ".join(constraint_text(node) for node in parsed["constraints"])
+    return text + "."
+
+def validate_problem(description, parser=None):
+    """
+    Checks that a problem description follows the grammar without loading z3. Returns a
+    dictionary telling whether it is "valid", the parse "error" otherwise, and for valid
+    problems the number of "equations" and "constraints", the sorted "variables", the
+    "canonical" text of the problem and its "key" (see cache.canonical_problem).
+
+    Examples:
+    >>> result = validate_problem("Solve 2 = x - z + 3, x*y = u*u such that x > 2 or (u < y and 3 > z).")
+    >>> result["valid"], result["equations"], result["constraints"], result["variables"]
+    (True, 2, 1, ['u', 'x', 'y', 'z'])
+    >>> print(result["canonical"])
+    Solve x - z = -1, u^2 - x*y = 0 such that x > 2 or (u - y < 0 and -z > -3).
+    >>> validate_problem(result["canonical"])["key"] == result["key"]
+    True
+    >>> validate_problem("Solve x + = 1.")["error"]
+    "Expected a constant, variable or '(' but found '=' (at offset 10)"
+    >>> import subprocess
+    >>> code = "import backend, validate; validate.validate_problem('Solve x*x = 4.'); print(backend.z3_loaded())"
+    >>> subprocess.run([sys.executable, "-c", code], capture_output=True, text=True).stdout
+    'False\\n'
+    """
+    if parser is None:
+        parser = ParseDiophantine()
+    try:
+        parsed = parser.parse_problem(description)
+    except ParseError as error:
+        return {"valid": False, "error": str(error)}
+
+    names = set()
+    for node in list(parsed["equations"]) + list(parsed["constraints"]):
+        names |= node.variables()
+    return {
+        "valid": True,
+        "error": None,
+        "equations": len(parsed["equations"]),
+        "constraints": len(parsed["constraints"]),
+        "variables": sorted(names),
+        "canonical": canonical_text(parsed),
+        "key": canonical_problem(parsed)[0]
+    }
+
+def main(arguments=None):
+    argument_parser = argparse.ArgumentParser(description="Check that problem files parse, without loading z3")
+    argument_parser.add_argument("paths", nargs="+", help="problem files")
+    argument_parser.add_argument("--canonical", action="store_true", help="print every valid problem in canonical form")
+    arguments = argument_parser.parse_args(arguments)
+
+    parser = ParseDiophantine()
+    invalid = 0
+    for path in arguments.paths:
+        with open(path) as file:
+            result = validate_problem(file.read(), parser)
+        if not result["valid"]:
+            invalid += 1
+            print(f"{path}: {result['error']}")
+        elif arguments.canonical:
+            print(f"{path}: {result['canonical']}")
+        else:
+            print(f"{path}: ok, {result['equations']} equations, {result['constraints']} constraints, {len(result['variables'])} variables")
+    return 1 if invalid else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
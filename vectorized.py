@@ -0,0 +1,128 @@
+from symbolic_classes import postorder, Equation, Variable, Constant, Addition, Multiplication, Power, Conjunction, OrUnion, GreaterThan, LessThan
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Vectorized evaluation of equations and constraints with NumPy
+#
+# A list of trees of the symbolic classes is compiled once into a list of nodes in
+# post-order (operands first), which is evaluated by a single loop working on whole
+# arrays, one array of candidate values per variable, so trees of any depth can be
+# evaluated. Before running, the largest possible magnitude of every intermediate
+# value is computed from the inputs; if it does not fit in int64 the kernel runs on
+# object arrays of Python integers instead, so results are always exact.
+
+INT64_LIMIT = 2 ** 62
+
+def reduce_operands(operation, operands):
+    result = operands[0]
+    for operand in operands[1:]:
+        result = operation(result, operand)
+    return result
+
+def array_operation(node, operands, values):
+    '''
+    Evaluates a node on arrays given the arrays of its operands and the dictionary of the variables
+    '''
+    if isinstance(node, Variable):
+        return values[node.name]
+    if isinstance(node, Constant):
+        return node.value
+    if isinstance(node, Addition):
+        return reduce_operands(lambda a, b: a + b, operands)
+    if isinstance(node, Multiplication):
+        return reduce_operands(lambda a, b: a * b, operands)
+    if isinstance(node, Power):
+        return operands[0] ** node.exponent
+    if isinstance(node, Equation):
+        return operands[0] == operands[1]
+    if isinstance(node, GreaterThan):
+        return operands[0] > operands[1]
+    if isinstance(node, LessThan):
+        return operands[0] < operands[1]
+    if isinstance(node, Conjunction):
+        return reduce_operands(lambda a, b: a & b, operands)
+    if isinstance(node, OrUnion):
+        return reduce_operands(lambda a, b: a | b, operands)
+    raise TypeError(f"Cannot compile {type(node).__name__}")
+
+def value_bound(node, operands, bounds):
+    '''
+    Returns (largest absolute value of a node, largest absolute value of its intermediate results)
+    given the largest absolute values of its operands and of the variables
+    '''
+    if isinstance(node, Variable):
+        return bounds[node.name], bounds[node.name]
+    if isinstance(node, Constant):
+        return abs(node.value), abs(node.value)
+    if isinstance(node, Addition):
+        return sum(operands), sum(operands)
+    if isinstance(node, Multiplication):
+        # operands are multiplied from left to right, a later zero does not undo an overflow
+        product = peak = operands[0]
+        for operand in operands[1:]:
+            product *= operand
+            peak = max(peak, product)
+        return product, peak
+    if isinstance(node, Power):
+        return operands[0] ** node.exponent, operands[0] ** node.exponent
+    # relations are booleans
+    return 0, 0
+
+class Kernel:
+    """
+    Vectorized check of a list of Equations and constraints: called with a dictionary
+    {variable name: array of integers} it returns a boolean array telling which points
+    satisfy all of them.
+
+    Example:
+    >>> from parsers import ParseDiophantine
+    >>> parsed = ParseDiophantine().parse_problem("Solve x + y = 3 such that x > 1 or y < 0.")
+    >>> kernel = Kernel(parsed["equations"] + parsed["constraints"])
+    >>> kernel({"x": [0, 2, 4, 3], "y": [3, 1, -1, 1]}).tolist()
+    [False, True, True, False]
+    >>> kernel({"x": [2 ** 70], "y": [3 - 2 ** 70]}).tolist()
+    [True]
+    """
+    def __init__(self, nodes):
+        if np is None:
+            raise ImportError("Vectorized evaluation requires numpy")
+        if not isinstance(nodes, list):
+            nodes = [nodes]
+        self.roots = nodes
+        self.order = list(postorder(nodes))
+        self.variables = {node.name for node in self.order if isinstance(node, Variable)}
+
+    def fits_int64(self, bounds):
+        peak = 0
+        values = {}
+        for node in self.order:
+            values[id(node)], node_peak = value_bound(node, [values[id(operand)] for operand in node.operands()], bounds)
+            peak = max(peak, node_peak)
+        return peak < INT64_LIMIT
+
+    def __call__(self, values):
+        arrays = {name: np.asarray(values[name]) for name in self.variables}
+        bounds = {}
+        for name, array in arrays.items():
+            bounds[name] = max(abs(int(array.min())), abs(int(array.max()))) if array.size else 0
+
+        dtype = np.int64 if self.fits_int64(bounds) else object
+        arrays = {name: array.astype(dtype) for name, array in arrays.items()}
+        shape = np.broadcast_shapes(*(array.shape for array in arrays.values())) if arrays else ()
+
+        results = {}
+        for node in self.order:
+            results[id(node)] = array_operation(node, [results[id(operand)] for operand in node.operands()], arrays)
+        mask = np.ones(shape, dtype=bool)
+        for root in self.roots:
+            mask &= np.asarray(results[id(root)]).astype(bool)
+        return mask
+
+def compile_problem(parsed):
+    '''
+    Returns the Kernel checking every equation and constraint of a parsed problem
+    '''
+    return Kernel(list(parsed["equations"]) + list(parsed["constraints"]))